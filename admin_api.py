@@ -1,6 +1,7 @@
-import subprocess
 import os
 import json
+import urllib.request
+import urllib.error
 from flask import (
     Flask,
     render_template,
@@ -15,16 +16,21 @@ from flask import (
     after_this_request,
     render_template_string,
 )
-from flask_basicauth import BasicAuth
 from datetime import datetime, timezone
 from threading import Thread
 from time import sleep
+from files.auth import AdminAuth
+from files.health import Sampler
 
 environment = os.getenv("FLASK_ENV", "development")
 application = Flask(__name__, template_folder="templates", static_folder="static")
-application.config["BASIC_AUTH_USERNAME"] = "admin"
-application.config["BASIC_AUTH_PASSWORD"] = "LyNx2017@chaozhou"
-basic_auth = BasicAuth(application)
+basic_auth = AdminAuth(application)
+# Dashboard process (app.py), which reloads its own artifacts
+dashboard_url = os.getenv("DASHBOARD_URL", "http://127.0.0.1:80")
+# Memory, load and battery read from /proc and /sys in the background
+sampler = Sampler().start()
+# History returned by the health check unless ?window= asks for more or less
+HEALTH_WINDOW = float(os.getenv("HEALTH_WINDOW_SECONDS", 60))
 
 ###############
 # API Helpers
@@ -54,15 +60,24 @@ def execute(commands:list) -> bool:
 @application.route("/admin/hc")
 @basic_auth.required
 def health_check():
+    # Only copies what the sampler already read: no process is spawned per scrape.
+    # Unhealthy (503) once the newest sample is a few intervals old: the sampler
+    # stopped and the figures would only repeat themselves.
     try:
-        memory = subprocess.check_output("free -h".split()).decode("utf-8").rstrip().split()
-        metrics = dict(
-            battery_status = subprocess.check_output("cat /sys/class/power_supply/BAT0/status".split()).decode("utf-8").rstrip(),
-            memory= {k:v for k,v in zip(memory[:6],memory[7:13])},
-            uptime=subprocess.check_output("uptime".split()).decode("utf-8").rstrip(),
-        )
-    except Exception as e:
-         return build_error("Could not return metrics %s"%e)
+        window = float(request.args.get("window", HEALTH_WINDOW))
+    except ValueError:
+        return build_error("window must be a number of seconds", 400)
+    latest = sampler.latest()
+    if latest is None:
+        return build_error("No health sample taken yet", 503)
+    metrics = dict(latest)
+    metrics["ts"] = datetime.fromtimestamp(latest["ts"], timezone.utc).isoformat()
+    metrics["age"] = round(sampler.age(), 3)
+    metrics["healthy"] = not sampler.is_stale()
+    metrics["interval"] = sampler.interval
+    metrics["history"] = sampler.history(window)
+    if not metrics["healthy"]:
+        return Response(json.dumps(metrics), mimetype="application/json", status=503)
     return build_success(metrics)
 
 @application.route("/admin/control_panel/<string:command>")
@@ -82,5 +97,41 @@ def control_panel(command):
     Thread(target=execute, args=[commands]).start()
     return build_success({"msg":"Commands Registered", "commands":commands})
     
+def forward(path: str) -> Response:
+    # Passes the request on to the dashboard with the same credentials
+    forward = urllib.request.Request(
+        "%s%s?%s" % (dashboard_url, path, request.query_string.decode()),
+        method=request.method,
+        headers={"Authorization": request.headers.get("Authorization", "")},
+    )
+    try:
+        with urllib.request.urlopen(forward, timeout=10) as response:
+            return Response(
+                response.read(),
+                content_type=response.headers.get("Content-Type"),
+                status=response.status,
+            )
+    except urllib.error.HTTPError as e:
+        return Response(
+            e.read(), content_type=e.headers.get("Content-Type"), status=e.code
+        )
+    except urllib.error.URLError as e:
+        return build_error("Dashboard unreachable: %s" % e.reason, 502)
+
+
+@application.route("/admin/reload", methods=["GET", "POST"])
+@basic_auth.required
+def reload():
+    # Forwarded to the dashboard, which rebuilds and swaps its artifacts in the
+    # background while it keeps serving: no restart, no dropped requests
+    return forward("/admin/reload")
+
+
+@application.route("/admin/metrics")
+@basic_auth.required
+def dashboard_metrics():
+    # Prometheus scrape target for the dashboard, nginx sends /admin here
+    return forward("/admin/metrics")
+
 if __name__ == "__main__":
     application.run(host="0.0.0.0", port=5001, debug=True)
@@ -1,5 +1,6 @@
 import os
 import json
+import gzip
 from flask import (
     Flask,
     render_template,
@@ -14,23 +15,36 @@ from flask import (
     after_this_request,
     render_template_string,
 )
+from werkzeug.wsgi import wrap_file
 from markupsafe import Markup
 from datetime import datetime, timezone
-import folium
-from branca.element import MacroElement
-from files.backend import Backend
+from time import perf_counter
+from flask import g
+from files import artifacts
+from files.auth import AdminAuth
+from files.api import LRUCache, dumps, select_years
+from files.metrics import BYTES_BUCKETS, build_metrics, merge, metrics, render
 
 environment = os.getenv("FLASK_ENV", "development")
+# "auto" rebuilds the maps when files/data changed since the last build,
+# "artifacts" only loads what `python -m files.artifacts build` wrote to disk
+dashboard_mode = os.getenv("DASHBOARD_MODE", "auto")
+# Points /api/lookup takes in one request
+lookup_max_points = int(os.getenv("LOOKUP_MAX_POINTS", 100000))
+# /api/query results kept by each worker, by normalized query
+query_cache = LRUCache(int(os.getenv("QUERY_CACHE_BYTES", 16 * 2**20)))
 application = Flask(__name__, template_folder="templates", static_folder="static")
+# Same credentials as admin_api.py, which forwards /admin/reload here
+basic_auth = AdminAuth(application)
 
-bkd = Backend()
-
-visuals = dict(
-    dual_RUC_map=bkd.make_RUC_dualmap(),
-    fibre_distribution_uk_slider=bkd.make_map_of_fibre_distribution_uk(),
-    eu_fttp_slider=bkd.make_eu_fftp_availability_map(),
-    eu_fttp_predictions_slider=bkd.make_eu_fftp_availability_predictions_map(),
-    fibre_distribution_predictions=bkd.make_map_of_fibre_predictions_uk(),
+if dashboard_mode == "auto" and not artifacts.is_fresh(artifacts.load_manifest()):
+    # in a child process, this one only ever holds the rendered files
+    artifacts.build_in_subprocess()
+# Serves artifacts.ArtifactStore objects, swapped for fresh ones by /admin/reload
+reloader = artifacts.Reloader()
+# Every gunicorn worker writes its counters there, /admin/metrics adds them up
+metrics.directory = os.getenv(
+    "METRICS_DIR", os.path.join(artifacts.ARTIFACTS_DIR, "metrics")
 )
 
 
@@ -64,12 +78,242 @@ def health_check():
 ################
 @application.route("/")
 def index():
-    return render_template("index.html", **visuals)
+    return render_template("index.html")
 
 
 @application.route("/test")
 def test():
-    return render_template("index.html", **visuals)
+    return render_template("index.html")
+
+
+def serve_artifact(name, cache_control="no-cache"):
+    store = reloader.store
+    if name not in store:
+        abort(404)
+    encoding, etag, variant = store.negotiate(name, request.accept_encodings)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        # Streamed from the artifact file (sendfile under gunicorn), never copied in
+        mimetype = "application/json" if name.startswith("api/") else "text/html"
+        body = wrap_file(request.environ, store.open(variant))
+        response = Response(body, mimetype=mimetype, direct_passthrough=True)
+        response.content_length = variant["bytes"]
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+@application.route("/maps/<string:name>")
+def map_visual(name):
+    # Revalidate on every use, the ETag makes that a cheap 304 until the next build
+    return serve_artifact(name)
+
+
+################
+#          DATA API          #
+################
+@application.route("/api/geometry/<string:region>")
+def api_geometry(region):
+    # Boundaries only change with a new boundary file, so browsers may keep them for a day
+    return serve_artifact("api/geometry/%s" % region, "public, max-age=86400")
+
+
+def serve_years(name):
+    # Serves a columnar payload, narrowed down to ?years= when given
+    if "years" not in request.args:
+        return serve_artifact(name)
+    store = reloader.store
+    if name not in store:
+        return build_error("Unknown payload %s" % name, 404)
+    try:
+        years = [int(year) for year in request.args["years"].split(",") if year]
+    except ValueError:
+        return build_error("years must be a comma separated list of years", 400)
+    etag = "%s-%s" % (store.sha256(name), "-".join(str(year) for year in years))
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        payload = select_years(store.json(name), years)
+        response = Response(dumps(payload), mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@application.route("/tiles/<string:layer>/<int:z>/<int:x>/<int:y>.pbf")
+def vector_tile(layer, z, x, y):
+    # Mapbox Vector Tiles cut at build time, so a map only fetches what is in view at
+    # the detail its zoom level needs. They change with a build at most: cached for a
+    # week, and revalidated against the sha256 of their MBTiles file after that.
+    store = reloader.store
+    if layer not in store.tiles:
+        return build_error("Unknown tile layer %s" % layer, 404)
+    entry = store.tiles[layer]
+    if not entry["minzoom"] <= z <= entry["maxzoom"]:
+        return build_error(
+            "%s tiles exist for zoom levels %s to %s"
+            % (layer, entry["minzoom"], entry["maxzoom"]),
+            404,
+        )
+    etag = "%s-%s-%s-%s" % (entry["sha256"], z, x, y)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        data = store.tile(layer, z, x, y)
+        if data is None:
+            # Nothing of the layer in this tile
+            response = Response(status=204)
+        elif request.accept_encodings["gzip"]:
+            response = Response(data, mimetype="application/vnd.mapbox-vector-tile")
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(
+                gzip.decompress(data), mimetype="application/vnd.mapbox-vector-tile"
+            )
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "public, max-age=604800"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+@application.route("/api/lookup", methods=["POST"])
+def api_lookup():
+    # Constituency, RUC label and FTTP of many coordinates in one request, either
+    # {"points": [[lat, lon], ...]} or {"lat": [...], "lon": [...]}. The answer is
+    # columnar: one list per attribute, aligned with the points, null where a point
+    # falls outside every constituency.
+    store = reloader.store
+    if "constituencies" not in store.lookups:
+        return build_error("No constituency index in this build", 404)
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return build_error('Expected {"points": [[lat, lon], ...]}', 400)
+    from files.lookup import parse_points
+
+    try:
+        lat, lon = parse_points(body)
+    except ValueError as e:
+        return build_error(str(e), 400)
+    if len(lat) > lookup_max_points:
+        return build_error("At most %d points per request" % lookup_max_points, 413)
+    result = store.point_index("constituencies").lookup(lat, lon)
+    return Response(dumps(result), mimetype="application/json")
+
+
+@application.route("/api/query", methods=["GET", "POST"])
+def api_query():
+    # POST runs a query (see files.query) over the tables of the build: filter,
+    # group_by, aggregate, sort and limit for the top k. GET lists the tables and
+    # their columns.
+    store = reloader.store
+    if "tables" not in store.queries:
+        return build_error("No query tables in this build", 404)
+    if request.method == "GET":
+        schema = store.query_engine().schema()
+        return Response(dumps(schema), mimetype="application/json")
+
+    from files.query import QueryError, key, normalize
+
+    try:
+        query = normalize(request.get_json(silent=True))
+    except QueryError as e:
+        return build_error(str(e), 400)
+    # Queries that differ only in how they are written share a result, results of
+    # another build don't
+    cache_key = "%s:%s" % (store.queries["tables"]["sha256"], key(query))
+    body = query_cache.get(cache_key)
+    metrics.inc(
+        "dashboard_cache_lookups_total",
+        cache="queries",
+        result="miss" if body is None else "memory",
+    )
+    if body is None:
+        try:
+            result = store.query_engine().run(query)
+        except QueryError as e:
+            return build_error(str(e), 400)
+        body = dumps(dict(query=query, **result))
+        query_cache.put(cache_key, body)
+    return Response(body, mimetype="application/json")
+
+
+@application.route("/api/values/<string:metric>")
+def api_values(metric):
+    return serve_years("api/values/%s" % metric)
+
+
+@application.route("/api/darkspots")
+def api_darkspots():
+    # Postcodes and premises below the full fibre and speed thresholds, per constituency
+    return serve_years("api/darkspots")
+
+
+@application.route("/api/colormap/<string:metric>")
+def api_colormap(metric):
+    return serve_artifact("api/colormap/%s" % metric)
+
+
+@application.before_request
+def follow_reloads():
+    g.started = perf_counter()
+    # Another worker may have rebuilt the artifacts (see gunicorn.conf.py)
+    reloader.follow()
+
+
+@application.after_request
+def record_request(response):
+    # Routes rather than paths as labels, so that there is one series per endpoint.
+    # Bodies sent with sendfile are counted from Content-Length, their time is not.
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    seconds = perf_counter() - g.get("started", perf_counter())
+    metrics.inc(
+        "dashboard_http_requests_total",
+        route=route,
+        method=request.method,
+        status=response.status_code,
+    )
+    metrics.observe("dashboard_http_request_duration_seconds", seconds, route=route)
+    metrics.observe(
+        "dashboard_http_response_bytes",
+        response.content_length or 0,
+        BYTES_BUCKETS,
+        route=route,
+    )
+    metrics.flush()
+    return response
+
+
+################
+#            ADMIN             #
+################
+@application.route("/admin/reload", methods=["GET", "POST"])
+@basic_auth.required
+def admin_reload():
+    # POST rebuilds what changed under files/data (everything with ?force=1) in the
+    # background and swaps it in once complete; GET reports how the last reload went,
+    # on whichever worker it ran, and what the worker answering serves
+    if request.method == "POST":
+        force = request.args.get("force", "0").lower() in ("1", "true", "yes")
+        if not reloader.reload(force=force):
+            return build_error("A reload is already running", 409)
+    return build_success(reloader.status())
+
+
+@application.route("/admin/metrics")
+@basic_auth.required
+def admin_metrics():
+    # Prometheus text format: requests and caches of every worker, and what the
+    # manifest of the artifacts being served says about their build
+    snapshot, gauges = build_metrics(reloader.store.manifest)
+    return Response(
+        render(merge([metrics.collect(), snapshot]), gauges),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
 
 
 if __name__ == "__main__":
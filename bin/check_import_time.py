@@ -0,0 +1,78 @@
+import os
+import sys
+import argparse
+import subprocess
+
+# Serving the dashboard (app.py with DASHBOARD_MODE=artifacts, admin_api.py) only reads
+# the rendered artifacts. The data and map libraries belong to the build, which
+# files.artifacts runs in its own process: none of them may be imported to serve.
+SERVING_MODULES = ["app", "admin_api"]
+BUILD_ONLY = [
+    "pandas",
+    "numpy",
+    "geopandas",
+    "shapely",
+    "pyogrio",
+    "folium",
+    "branca",
+    "pyarrow",
+    "mapbox_vector_tile",
+    "files.backend",
+    "files.tiles",
+    "files.lookup",
+    "files.query",
+]
+BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", 600))
+
+
+def import_times(module: str) -> dict:
+    # -X importtime writes "import time: self [us] | cumulative | imported package"
+    # to stderr for every module imported, nested ones indented under their parent
+    env = dict(os.environ, DASHBOARD_MODE="artifacts")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(result.stderr.strip().splitlines()[-1])
+    times = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fails when importing the serving modules exceeds a time budget "
+        "or pulls in a build only library. Run from the repository root after "
+        "`python -m files.artifacts build`."
+    )
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument(
+        "--runs", type=int, default=3, help="the fastest run is compared to the budget"
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for module in SERVING_MODULES:
+        runs = [import_times(module) for _ in range(args.runs)]
+        times = min(runs, key=lambda times: times[module])
+        heavy = [name for name in BUILD_ONLY if name in times]
+        print(
+            "%-12s %8.1f ms (budget %.0f ms)" % (module, times[module], args.budget_ms)
+        )
+        if heavy:
+            print("  imports build only modules: %s" % ", ".join(heavy))
+            failed = True
+        if times[module] > args.budget_ms:
+            slowest = sorted(times.items(), key=lambda item: -item[1])[1:6]
+            for name, ms in slowest:
+                print("  %-40s %8.1f ms" % (name, ms))
+            failed = True
+    sys.exit(1 if failed else 0)
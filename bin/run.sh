@@ -10,4 +10,4 @@ source env/bin/activate
 
 fuser -kn tcp 8000
 python admin_api.py  &
-python app.py
+gunicorn -c gunicorn.conf.py
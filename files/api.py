@@ -0,0 +1,54 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+def dumps(data) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def select_years(payload: dict, years: list) -> dict:
+    # payload is columnar: one list of values per year, aligned with "regions", either
+    # under "values" or under each of "metrics"
+    keep = [n for n, year in enumerate(payload["years"]) if year in years]
+    selected = dict(payload, years=[payload["years"][n] for n in keep])
+    if "values" in payload:
+        selected["values"] = [payload["values"][n] for n in keep]
+    if "metrics" in payload:
+        selected["metrics"] = {
+            metric: [values[n] for n in keep]
+            for metric, values in payload["metrics"].items()
+        }
+    return selected
+
+
+class LRUCache:
+    # Encoded responses by key, the least recently used dropped first once they add up
+    # to more than max_bytes. Shared by the threads of a worker.
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self.bytes += len(value)
+            while self.bytes > self.max_bytes:
+                self.bytes -= len(self._entries.popitem(last=False)[1])
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,907 @@
+import os
+import io
+import gc
+import sys
+import json
+import gzip
+import mmap
+import ctypes
+import hashlib
+import fcntl
+import argparse
+import tempfile
+import subprocess
+import sqlite3
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from time import perf_counter, monotonic
+from datetime import datetime, timezone
+from typing import Optional
+from files import scheduler
+from files.metrics import metrics, merge
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DATA_DIR = "files/data"
+ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", "artifacts")
+MANIFEST = "manifest.json"
+BUILD_LOCK = ".build.lock"
+# How the last /admin/reload went, written by whichever gunicorn worker ran it
+RELOAD_STATUS = "reload-status.json"
+
+# Rendered visual name (as used by templates/index.html) -> Backend method that renders it
+MAPS = {
+    "dual_RUC_map": "make_RUC_dualmap",
+    "fibre_distribution_uk_slider": "make_map_of_fibre_distribution_uk",
+    "eu_fttp_slider": "make_eu_fftp_availability_map",
+    "eu_fttp_predictions_slider": "make_eu_fftp_availability_predictions_map",
+    "fibre_distribution_predictions": "make_map_of_fibre_predictions_uk",
+    "darkspots_map": "make_darkspots_map",
+}
+# Data stages of the build: stage -> (Backend method, arguments, attribute it fills).
+# Stages run in worker processes and their results are handed to the tasks reading them.
+# The per year stages (full_fibre_<year>) are added by build_graph for every Ofcom
+# release in files.catalogue.
+STAGES = {
+    "eu_broadband": ("load_eu_broadband", (), "eu_broadband_geo"),
+    "eu_broadband_predictions": (
+        "load_eu_broadband_predictions",
+        (),
+        "eu_broadband_predictions_geo",
+    ),
+    "constituencies_with_RUC": (
+        "load_constituencies_with_RUC",
+        (),
+        "constituencies_with_RUC",
+    ),
+    "constituency_predictions": (
+        "get_constituency_predictions",
+        (False,),
+        "constituency_predictions",
+    ),
+    "darkspots": ("get_darkspots", (), "darkspots"),
+}
+# Stages each rendered artifact reads, "api" being the payloads served under /api.
+# "full_fibre" stands for every full_fibre_<year> stage.
+ARTIFACT_STAGES = {
+    "dual_RUC_map": ["constituencies_with_RUC"],
+    "fibre_distribution_uk_slider": ["full_fibre"],
+    "eu_fttp_slider": ["eu_broadband"],
+    "eu_fttp_predictions_slider": ["eu_broadband_predictions"],
+    "fibre_distribution_predictions": ["constituency_predictions"],
+    "darkspots_map": ["darkspots"],
+    "api": list(STAGES) + ["full_fibre"],
+    "tiles": [
+        "eu_broadband",
+        "eu_broadband_predictions",
+        "constituencies_with_RUC",
+        "constituency_predictions",
+        "full_fibre",
+    ],
+    "lookup": [
+        "eu_broadband",
+        "eu_broadband_predictions",
+        "constituencies_with_RUC",
+        "constituency_predictions",
+        "full_fibre",
+    ],
+    "query": [
+        "eu_broadband",
+        "eu_broadband_predictions",
+        "constituencies_with_RUC",
+        "constituency_predictions",
+        "full_fibre",
+    ],
+}
+# Boundary set each map embeds, and how many copies of it
+MAP_GEOMETRY = {
+    "dual_RUC_map": ("uk", 2),
+    "fibre_distribution_uk_slider": ("uk", 1),
+    "eu_fttp_slider": ("eu", 1),
+    "eu_fttp_predictions_slider": ("eu", 1),
+    "fibre_distribution_predictions": ("uk", 1),
+    # markers over a tile layer, no boundary geometry embedded
+    "darkspots_map": ("uk", 0),
+}
+# Vector tile layers served under /tiles, one MBTiles file cut for these zoom levels
+TILE_LAYERS = {
+    "constituencies": dict(boundaries="uk", minzoom=4, maxzoom=10),
+    "countries": dict(boundaries="eu", minzoom=2, maxzoom=7),
+}
+# Attributes /api/lookup returns for the constituency of each point
+LOOKUP_ATTRIBUTES = ["code", "name", "ruc", "fttp", "fttp_predicted"]
+
+
+#########################
+#                  Input hashing                        #
+#########################
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_inputs(data_dir: str = DATA_DIR) -> dict:
+    # Derived files (parsed tables, simplified geometries...) live under cache/ and are not inputs,
+    # checksums.json only pins the raw files that are hashed here anyway, its lock and
+    # files being written (temp_path) are no inputs either
+    hashes = {}
+    for root, dirs, files in os.walk(data_dir):
+        dirs[:] = sorted(d for d in dirs if d != "cache")
+        for file in sorted(files):
+            if file == "checksums.json" or file.endswith((".lock", ".tmp")):
+                continue
+            path = os.path.join(root, file)
+            hashes[os.path.relpath(path, data_dir)] = file_sha256(path)
+    return hashes
+
+
+#########################
+#                Dependency graph                      #
+#########################
+def build_graph(data_dir: str = DATA_DIR, offline: bool = False) -> dict:
+    # stages: stage -> (Backend method, arguments, attribute)
+    # inputs: stage -> files it reads
+    # artifacts: artifact -> stages it reads
+    # offline: only the releases on disk, none of the remote ones to download
+    from files.catalogue import Catalogue
+    from files.datasets import EU_BROADBAND_WORKBOOK, EU_FIBRE_CSV
+    from files.geometry import BOUNDARY_SETS
+    from files.postcodes import POSTCODE_LOOKUP
+
+    catalogue = Catalogue(data_dir)
+    if offline:
+        catalogue.remote = []
+    ofcom = {
+        year: os.path.join(data_dir, filename)
+        for year, filename in catalogue.releases("pcon").items()
+    }
+    uk, eu = BOUNDARY_SETS["uk"]["path"], BOUNDARY_SETS["eu"]["path"]
+    stages = dict(STAGES)
+    inputs = {
+        "eu_broadband": [EU_BROADBAND_WORKBOOK, eu],
+        "eu_broadband_predictions": [EU_FIBRE_CSV, eu],
+        # the rural/urban comparison is drawn for the release describing 2023
+        "constituencies_with_RUC": [
+            uk,
+            os.path.join(data_dir, "pcon_ruc.csv"),
+            ofcom.get(2023),
+        ],
+        # predictions are fitted on the five latest releases
+        "constituency_predictions": [uk] + list(ofcom.values())[-5:],
+        "darkspots": [POSTCODE_LOOKUP]
+        + [
+            os.path.join(data_dir, filename)
+            for filename in catalogue.releases("pc").values()
+        ],
+    }
+    full_fibre = []
+    for year, path in ofcom.items():
+        stage = "full_fibre_%s" % year
+        stages[stage] = ("get_full_fibre_availability", (year,), None)
+        inputs[stage] = [uk, path]
+        full_fibre.append(stage)
+
+    artifacts = dict()
+    for name, names in ARTIFACT_STAGES.items():
+        artifacts[name] = []
+        for stage in names:
+            artifacts[name] += full_fibre if stage == "full_fibre" else [stage]
+    inputs = {
+        stage: sorted(path for path in paths if path is not None)
+        for stage, paths in inputs.items()
+    }
+    return dict(stages=stages, inputs=inputs, artifacts=artifacts)
+
+
+def input_digest(path: str, hashes: dict, data_dir: str = DATA_DIR) -> str:
+    relpath = os.path.relpath(path, data_dir)
+    if relpath in hashes:
+        return hashes[relpath]
+    if os.path.exists(path):
+        return file_sha256(path)
+    # A remote release that has not been downloaded yet, known by its pinned checksum
+    checksums = os.path.join(data_dir, "checksums.json")
+    if os.path.exists(checksums):
+        with open(checksums) as f:
+            return json.load(f).get(os.path.basename(path), "absent")
+    return "absent"
+
+
+def fingerprints(graph: dict, hashes: dict, data_dir: str = DATA_DIR) -> dict:
+    # artifact -> sha256 over the digests of every file its stages read, so that an
+    # artifact is only rebuilt when one of its own inputs changed
+    stages = dict()
+    for stage, paths in graph["inputs"].items():
+        digests = [
+            [os.path.relpath(path, data_dir), input_digest(path, hashes, data_dir)]
+            for path in paths
+        ]
+        stages[stage] = hashlib.sha256(json.dumps([stage, digests]).encode()).hexdigest()
+    return {
+        name: hashlib.sha256(
+            json.dumps([[stage, stages.get(stage)] for stage in names]).encode()
+        ).hexdigest()
+        for name, names in graph["artifacts"].items()
+    }
+
+
+def is_current(
+    manifest: Optional[dict], name: str, fingerprint: str, output_dir: str
+) -> bool:
+    # Built by the last build from the same inputs, and still on disk
+    if manifest is None or manifest.get("fingerprints", {}).get(name) != fingerprint:
+        return False
+    if name in ("api", "tiles", "lookup", "query"):
+        entries = list(manifest.get(name, {}).values())
+    else:
+        entries = [manifest["maps"][name]] if name in manifest["maps"] else []
+    return bool(entries) and all(
+        os.path.exists(os.path.join(output_dir, entry["file"])) for entry in entries
+    )
+
+
+#########################
+#                  Artifact files                        #
+#########################
+def temp_path(path: str) -> str:
+    # A new file next to path to write it in before os.replace(tmp, path). The build's
+    # worker processes may write the same path at once, each gets its own file.
+    directory, name = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(
+        prefix=".%s." % name, suffix=".tmp", dir=directory or "."
+    )
+    os.fchmod(fd, 0o644)
+    os.close(fd)
+    return tmp
+
+
+def write_atomic(path: str, data: bytes):
+    tmp = temp_path(path)
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def load_manifest(output_dir: str = ARTIFACTS_DIR) -> Optional[dict]:
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def is_fresh(manifest: Optional[dict], data_dir: str = DATA_DIR) -> bool:
+    if manifest is None:
+        return False
+    if set(manifest.get("maps", {})) != set(MAPS):
+        return False
+    return manifest.get("inputs") == hash_inputs(data_dir)
+
+
+def compress(data: bytes) -> dict:
+    # Precompressed variants of an artifact, keyed by Content-Encoding
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return variants
+
+
+def write_artifact(output_dir: str, filename: str, data: bytes) -> dict:
+    write_atomic(os.path.join(output_dir, filename), data)
+    encodings = dict()
+    for encoding, compressed in compress(data).items():
+        encodings[encoding] = {
+            "file": "%s.%s" % (filename, "gz" if encoding == "gzip" else encoding),
+            "bytes": len(compressed),
+        }
+        write_atomic(os.path.join(output_dir, encodings[encoding]["file"]), compressed)
+    return {
+        "file": filename,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "bytes": len(data),
+        "encodings": encodings,
+    }
+
+
+class MappedReader(io.RawIOBase):
+    # Reads an artifact from its mapped pages, for the WSGI file wrapper
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), len(self.view) - self.position)
+        buffer[:size] = self.view[self.position : self.position + size]
+        self.position += size
+        return size
+
+
+class ArtifactStore:
+    # Rendered artifacts and their precompressed variants, memory mapped from the
+    # artifacts directory. The pages belong to the page cache, so every worker serves
+    # the same copy and none of it lives on the Python heap.
+    # Maps are keyed by name, API payloads by "api/<name>"; vector tiles are looked up
+    # in the MBTiles file of their layer instead (see tile()).
+    # ETags are strong: the sha256 of the artifact recorded in the manifest, suffixed
+    # with the encoding so that each representation has its own validator.
+    def __init__(self, output_dir: str = ARTIFACTS_DIR):
+        self.output_dir = output_dir
+        self.manifest = load_manifest(output_dir)
+        if self.manifest is None:
+            raise FileNotFoundError(
+                "No artifacts in %s, run `python -m files.artifacts build` first"
+                % output_dir
+            )
+        self.entries = dict()
+        self._json = dict()
+        for name, entry in self.manifest["maps"].items():
+            self.entries[name] = self.load_entry(entry)
+        for name, entry in self.manifest.get("api", {}).items():
+            self.entries["api/%s" % name] = self.load_entry(entry)
+        self.tiles = self.manifest.get("tiles", {})
+        self._local = threading.local()
+        self.lookups = self.manifest.get("lookup", {})
+        self._indexes = dict()
+        self.queries = self.manifest.get("query", {})
+        self._engine = None
+
+    def load_entry(self, entry: dict) -> dict:
+        variants = {"identity": self.map_file(entry["file"])}
+        for encoding, variant in entry.get("encodings", {}).items():
+            variants[encoding] = self.map_file(variant["file"])
+        return dict(sha256=entry["sha256"], variants=variants)
+
+    def map_file(self, filename: str) -> dict:
+        path = os.path.join(self.output_dir, filename)
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            data = b""
+            if stat.st_size:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return dict(
+            path=path, inode=(stat.st_dev, stat.st_ino), bytes=stat.st_size, data=data
+        )
+
+    def open(self, variant: dict):
+        # The artifact as a file for the WSGI file wrapper, which gunicorn sends with
+        # sendfile(). A later build may have replaced the file on disk (write_atomic),
+        # the mapped pages of the version this store serves are read instead then.
+        try:
+            f = open(variant["path"], "rb")
+        except FileNotFoundError:
+            return MappedReader(variant["data"])
+        stat = os.fstat(f.fileno())
+        if (stat.st_dev, stat.st_ino) != variant["inode"]:
+            f.close()
+            return MappedReader(variant["data"])
+        return f
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def names(self) -> list:
+        return list(self.manifest["maps"])
+
+    def sha256(self, name: str) -> str:
+        return self.entries[name]["sha256"]
+
+    def json(self, name: str):
+        result = "memory" if name in self._json else "miss"
+        metrics.inc("dashboard_cache_lookups_total", cache="payloads", result=result)
+        if result == "miss":
+            data = self.entries[name]["variants"]["identity"]["data"]
+            self._json[name] = json.loads(data[:])
+        return self._json[name]
+
+    def tile(self, layer: str, z: int, x: int, y: int) -> Optional[bytes]:
+        # Gzipped MVT of an XYZ tile, None where the layer has nothing to draw. Each
+        # thread opens its own SQLite connections on first use, after gunicorn forked.
+        connections = self._local.__dict__.setdefault("connections", dict())
+        if layer not in connections:
+            path = os.path.join(self.output_dir, self.tiles[layer]["file"])
+            path = os.path.abspath(path)
+            connections[layer] = sqlite3.connect(
+                "file:%s?mode=ro&immutable=1" % urllib.parse.quote(path), uri=True
+            )
+        row = connections[layer].execute(
+            "SELECT tile_data FROM tiles "
+            "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, 2**z - 1 - y),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def point_index(self, name: str):
+        # Loaded on first use: numpy and shapely are only imported by the processes
+        # that get asked for a lookup
+        if name not in self._indexes:
+            from files.lookup import PointIndex
+
+            path = os.path.join(self.output_dir, self.lookups[name]["file"])
+            self._indexes[name] = PointIndex(path)
+        return self._indexes[name]
+
+    def query_engine(self):
+        # Loaded on first use, as point_index()
+        if self._engine is None:
+            from files.query import QueryEngine
+
+            path = os.path.join(self.output_dir, self.queries["tables"]["file"])
+            self._engine = QueryEngine(path)
+        return self._engine
+
+    def negotiate(self, name: str, accept_encodings) -> tuple:
+        # Returns (encoding, etag, variant) for the best variant the client accepts
+        variants = self.entries[name]["variants"]
+        for encoding in ("br", "gzip"):
+            if encoding in variants and accept_encodings[encoding]:
+                etag = "%s-%s" % (self.entries[name]["sha256"], encoding)
+                return encoding, etag, variants[encoding]
+        return "identity", self.entries[name]["sha256"], variants["identity"]
+
+
+class Reloader:
+    # Holds the ArtifactStore being served and refreshes it without downtime: a background
+    # thread brings the artifacts on disk up to date (build_in_subprocess), loads them
+    # into a new store and swaps it in with a single assignment. Requests keep being
+    # answered from the previous store until then, and read self.store once so that a
+    # swap never happens halfway through one of them.
+    # Under gunicorn every worker has its own Reloader: the one that rebuilt writes a new
+    # manifest and the others pick it up through follow(). It also writes its status
+    # next to the manifest, so that every worker reports the same last reload.
+    def __init__(self, output_dir: str = ARTIFACTS_DIR, data_dir: str = DATA_DIR):
+        self.output_dir = output_dir
+        self.data_dir = data_dir
+        self.load_store()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._checked = monotonic()
+        self._reloads = 0
+        self._status = dict(
+            state="idle",
+            pid=os.getpid(),
+            built_at=self.store.manifest["built_at"],
+            started_at=None,
+            finished_at=None,
+            seconds=None,
+            rebuilt=[],
+            error=None,
+        )
+
+    def manifest_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(os.path.join(self.output_dir, MANIFEST)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load_store(self):
+        mtime = self.manifest_mtime()
+        self.store = ArtifactStore(self.output_dir)
+        self._manifest_mtime = mtime
+
+    def status(self) -> dict:
+        # The last reload asked for on any worker (pid is the worker that ran it), and
+        # under "worker" what the worker answering serves
+        with self._lock:
+            status = dict(self._status)
+        try:
+            with open(os.path.join(self.output_dir, RELOAD_STATUS)) as f:
+                shared = json.load(f)
+        except (FileNotFoundError, ValueError):
+            shared = status
+        return dict(
+            shared,
+            worker=dict(
+                pid=os.getpid(),
+                state=status["state"],
+                error=status["error"],
+                reloads=self._reloads,
+                built_at=self.store.manifest["built_at"],
+                rss_bytes=rss_bytes(),
+            ),
+        )
+
+    def save_status(self, status: dict):
+        write_atomic(
+            os.path.join(self.output_dir, RELOAD_STATUS),
+            json.dumps(status, indent=2).encode(),
+        )
+
+    def follow(self, interval: float = 1.0):
+        # Loads artifacts built by another process, checking at most once per interval
+        if monotonic() - self._checked < interval:
+            return
+        self._checked = monotonic()
+        if self.manifest_mtime() not in (None, self._manifest_mtime):
+            self.reload(rebuild=False)
+
+    def reload(self, force: bool = False, rebuild: bool = True) -> bool:
+        # Starts a reload, False if one is already running
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._status.update(
+                state="running",
+                pid=os.getpid(),
+                started_at=datetime.now(timezone.utc).isoformat(),
+                finished_at=None,
+                seconds=None,
+                rebuilt=[],
+                error=None,
+            )
+            if rebuild:
+                self.save_status(self._status)
+            self._thread = threading.Thread(
+                target=self.run,
+                args=(force, rebuild),
+                name="artifact-reload",
+                daemon=True,
+            )
+            self._thread.start()
+        return True
+
+    def run(self, force: bool = False, rebuild: bool = True):
+        start = perf_counter()
+        status = dict()
+        try:
+            changed = True
+            if rebuild:
+                manifest = build_in_subprocess(self.output_dir, self.data_dir, force)
+                # A build with nothing to do leaves the manifest, and the store, alone
+                changed = self.manifest_mtime() != self._manifest_mtime
+                status.update(rebuilt=manifest["report"]["rebuilt"] if changed else [])
+            if changed:
+                self.load_store()
+            status.update(state="idle", built_at=self.store.manifest["built_at"])
+        except Exception as error:
+            # the previous store stays in place
+            status.update(state="failed", error=repr(error))
+        with self._lock:
+            self._reloads += 1
+            self._status.update(
+                status,
+                finished_at=datetime.now(timezone.utc).isoformat(),
+                seconds=round(perf_counter() - start, 3),
+            )
+            if rebuild:
+                self.save_status(self._status)
+
+    def wait(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+#########################
+#                      Build                                 #
+#########################
+def rss_bytes() -> Optional[int]:
+    # Resident set size of this process, None where /proc is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def release_memory():
+    # Frees what a build left behind in this process: the boundary sets, stage
+    # results, and the heap pages glibc keeps around once they are free
+    from files.geometry import registry
+
+    registry.invalidate()
+    BUILD_STAGES.clear()
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+# Stage table of the build being run, set in every worker by init_build_worker
+BUILD_STAGES = dict()
+# Options of the build the worker runs tasks for (offline)
+BUILD_OPTIONS = dict()
+
+
+def init_build_worker(boundaries: dict, reports: dict, stages: dict, options: dict):
+    # Boundary sets are loaded once by the parent and sent to each worker a single time
+    from files.geometry import registry
+
+    registry.seed(boundaries, reports)
+    BUILD_STAGES.clear()
+    BUILD_STAGES.update(stages)
+    BUILD_OPTIONS.clear()
+    BUILD_OPTIONS.update(options)
+
+
+def run_build_task(name: str, inputs: dict):
+    from files.backend import Backend
+
+    bkd = Backend(preload=False)
+    if BUILD_OPTIONS.get("offline"):
+        bkd.datasets.catalogue.remote = []
+    choropleth_data = dict()
+    for stage, result in inputs.items():
+        method, args, attribute = BUILD_STAGES[stage]
+        if attribute is not None:
+            setattr(bkd, attribute, result)
+        elif method == "get_full_fibre_availability":
+            choropleth_data[args[0]] = result
+    if choropleth_data:
+        bkd.choropleth_data = dict(sorted(choropleth_data.items()))
+
+    if name in BUILD_STAGES:
+        method, args, _ = BUILD_STAGES[name]
+        return getattr(bkd, method)(*args)
+    if name == "api":
+        return bkd.make_api_payloads()
+    if name == "tiles":
+        return bkd.make_vector_tiles(TILE_LAYERS)
+    if name == "lookup":
+        return bkd.get_constituency_lookup()
+    if name == "query":
+        return bkd.get_query_tables()
+    return getattr(bkd, MAPS[name])().encode("utf-8")
+
+
+def run_instrumented_task(name: str, inputs: dict) -> tuple:
+    # run_build_task, returning the metrics it recorded along with its result
+    metrics.take()
+    result = run_build_task(name, {stage: inputs[stage][0] for stage in inputs})
+    return result, metrics.take()
+
+
+@contextmanager
+def build_lock(output_dir: str):
+    # One build at a time per output directory, across processes (gunicorn workers,
+    # the command line...). A build that waited finds the artifacts up to date.
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, BUILD_LOCK), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build(
+    output_dir: str = ARTIFACTS_DIR,
+    data_dir: str = DATA_DIR,
+    workers: Optional[int] = None,
+    force: bool = False,
+    offline: bool = False,
+) -> dict:
+    # Rebuilds the artifacts whose inputs changed since the last build (all of them with
+    # force) and keeps the others as they are on disk. Offline builds never download a
+    # release, they are built from the ones on disk.
+    with build_lock(output_dir):
+        return build_artifacts(output_dir, data_dir, workers, force, offline)
+
+
+def build_in_subprocess(
+    output_dir: str = ARTIFACTS_DIR, data_dir: str = DATA_DIR, force: bool = False
+) -> dict:
+    # build() in a fresh interpreter, for the serving processes: the frames of the
+    # build, the libraries behind them and the heap they fragment go away with it
+    command = [sys.executable, "-m", "files.artifacts", "build"]
+    command += ["--output", output_dir, "--data", data_dir]
+    subprocess.run(command + (["--force"] if force else []), check=True)
+    return load_manifest(output_dir)
+
+
+def build_artifacts(
+    output_dir: str,
+    data_dir: str,
+    workers: Optional[int],
+    force: bool,
+    offline: bool = False,
+) -> dict:
+    # Imported here so that serving from artifacts never pays for geopandas/folium
+    from files.geometry import registry
+
+    rss_before = rss_bytes()
+    previous = None if force else load_manifest(output_dir)
+    graph = build_graph(data_dir, offline)
+    inputs = hash_inputs(data_dir)
+    current = fingerprints(graph, inputs, data_dir)
+    stale = [
+        name
+        for name in graph["artifacts"]
+        if not is_current(previous, name, current[name], output_dir)
+    ]
+    if not stale and previous is not None and previous.get("inputs") == inputs:
+        # Nothing changed: the manifest and the report of the build that made the
+        # artifacts are kept, a new manifest would have every worker reload for nothing
+        return previous
+    tasks = {stage: [] for name in stale for stage in graph["artifacts"][name]}
+    tasks.update({name: graph["artifacts"][name] for name in stale})
+
+    start = perf_counter()
+    workers = scheduler.default_workers() if workers is None else workers
+    results, seconds = dict(), dict()
+    if tasks:
+        # Boundary files may have changed since this process last read them
+        registry.invalidate()
+        boundaries = registry.frames()
+        results, seconds = scheduler.run(
+            tasks,
+            run_instrumented_task,
+            workers,
+            init_build_worker,
+            (boundaries, registry.reports(), graph["stages"], dict(offline=offline)),
+        )
+    # Cache lookups and data loaded, by the parent and by every task
+    task_metrics = [metrics.take()] + [task[1] for task in results.values()]
+    results = {name: task[0] for name, task in results.items()}
+    report = {
+        "build_seconds": round(perf_counter() - start, 3),
+        "workers": workers,
+        "rebuilt": stale,
+        "reused": [name for name in graph["artifacts"] if name not in stale],
+        "task_seconds": seconds,
+        "metrics": merge(task_metrics),
+    }
+
+    maps = dict()
+    for name in MAPS:
+        if name not in results:
+            maps[name] = previous["maps"][name]
+            continue
+        maps[name] = write_artifact(output_dir, "%s.html" % name, results[name])
+        maps[name]["seconds"] = seconds[name]
+        boundary_set, copies = MAP_GEOMETRY[name]
+        maps[name]["geometry_bytes_saved"] = (
+            copies * registry.report(boundary_set)["saved_bytes"]
+        )
+
+    # Geometry, per year values and colormaps served under /api
+    if "api" in results:
+        api = dict()
+        for name, payload in results["api"].items():
+            filename = "api-%s.json" % name.replace("/", "-")
+            api[name] = write_artifact(output_dir, filename, payload)
+    else:
+        api = previous["api"]
+
+    # Vector tiles served under /tiles, one MBTiles file per layer
+    if "tiles" in results:
+        from files.tiles import write_mbtiles
+
+        tiles = dict()
+        for layer, (metadata, layer_tiles) in results["tiles"].items():
+            filename = "tiles-%s.mbtiles" % layer
+            path = os.path.join(output_dir, filename)
+            write_mbtiles(path, metadata, layer_tiles)
+            tiles[layer] = {
+                "file": filename,
+                "sha256": file_sha256(path),
+                "bytes": os.path.getsize(path),
+                "tiles": len(layer_tiles),
+                "minzoom": TILE_LAYERS[layer]["minzoom"],
+                "maxzoom": TILE_LAYERS[layer]["maxzoom"],
+            }
+    else:
+        tiles = previous["tiles"]
+
+    # Point in constituency index behind /api/lookup
+    if "lookup" in results:
+        from files.lookup import write_index
+
+        boundaries, years = results["lookup"]
+        path = os.path.join(output_dir, "lookup-constituencies.npz")
+        write_index(path, boundaries, LOOKUP_ATTRIBUTES, years)
+        lookup = {
+            "constituencies": {
+                "file": os.path.basename(path),
+                "sha256": file_sha256(path),
+                "bytes": os.path.getsize(path),
+                "regions": len(boundaries),
+                "years": years,
+            }
+        }
+    else:
+        lookup = previous["lookup"]
+
+    # Tables behind /api/query
+    if "query" in results:
+        from files.query import write_tables
+
+        path = os.path.join(output_dir, "query-tables.npz")
+        write_tables(path, results["query"])
+        query = {
+            "tables": {
+                "file": os.path.basename(path),
+                "sha256": file_sha256(path),
+                "bytes": os.path.getsize(path),
+                "rows": {name: len(table) for name, table in results["query"].items()},
+            }
+        }
+    else:
+        query = previous["query"]
+
+    # Serving only needs the files written above, the frames behind them can go
+    geometry = registry.reports() or (previous or dict()).get("geometry", {})
+    report["rss_bytes"] = dict(before=rss_before, after_build=rss_bytes())
+    del results
+    release_memory()
+    report["rss_bytes"]["after_release"] = rss_bytes()
+
+    # Hashed again: releases fetched during the build are part of what it was built from
+    inputs = hash_inputs(data_dir)
+    manifest = {
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "inputs": inputs,
+        "fingerprints": fingerprints(graph, inputs, data_dir),
+        "maps": maps,
+        "api": api,
+        "tiles": tiles,
+        "lookup": lookup,
+        "query": query,
+        "report": report,
+        "geometry": geometry,
+    }
+    # The manifest is written last so that a half finished build is never picked up
+    write_atomic(
+        os.path.join(output_dir, MANIFEST), json.dumps(manifest, indent=2).encode()
+    )
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dashboard artifact pipeline")
+    parser.add_argument("command", choices=["build", "status"])
+    parser.add_argument("--output", default=ARTIFACTS_DIR)
+    parser.add_argument("--data", default=DATA_DIR)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="1 builds everything serially"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="rebuild artifacts whose inputs did not change"
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="download no release, use those on disk"
+    )
+    args = parser.parse_args()
+
+    if args.command == "build":
+        before = load_manifest(args.output)
+        manifest = build(args.output, args.data, args.workers, args.force, args.offline)
+        if manifest == before:
+            print("Up to date, built at %s" % manifest["built_at"])
+        else:
+            rss = manifest["report"]["rss_bytes"]
+            for name, entry in manifest["maps"].items():
+                print(
+                    "%-32s %10d bytes %8.2fs %10d geometry bytes saved%s"
+                    % (
+                        name,
+                        entry["bytes"],
+                        entry["seconds"],
+                        entry.get("geometry_bytes_saved", 0),
+                        "" if name in manifest["report"]["rebuilt"] else " (reused)",
+                    )
+                )
+            if None not in rss.values():
+                print(
+                    "RSS %.1f MB before, %.1f MB after the build, %.1f MB once released"
+                    % tuple(
+                        rss[key] / 2**20
+                        for key in ("before", "after_build", "after_release")
+                    )
+                )
+    else:
+        manifest = load_manifest(args.output)
+        print("fresh" if is_fresh(manifest, args.data) else "stale")
@@ -0,0 +1,18 @@
+import os
+from flask import current_app
+from flask_basicauth import BasicAuth
+
+
+class AdminAuth(BasicAuth):
+    # Basic auth of the /admin routes of app.py and admin_api.py, which forwards
+    # /admin/reload to app.py with the same credentials. The password only ever comes
+    # from ADMIN_PASSWORD: without it every admin request is refused.
+    def __init__(self, application):
+        application.config["BASIC_AUTH_USERNAME"] = os.getenv("ADMIN_USERNAME", "admin")
+        application.config["BASIC_AUTH_PASSWORD"] = os.getenv("ADMIN_PASSWORD")
+        super().__init__(application)
+
+    def check_credentials(self, username, password):
+        if not current_app.config["BASIC_AUTH_PASSWORD"]:
+            return False
+        return super().check_credentials(username, password)
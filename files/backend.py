@@ -1,64 +1,87 @@
 import os
-import geopandas as gpd
+import errno
+import warnings
+from typing import Optional, Tuple
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import string
+import geopandas as gpd
 import folium
 import folium.plugins
-from typing import Optional, Union, Tuple
-import boto3
-from datetime import datetime
-import numpy as np
-from branca.colormap import linear
-import os.path
-import glob
-import errno
-from functools import partial
-import seaborn as sns
-import matplotlib.pyplot as plt
-import io
-import base64
-from time import sleep
-import csv
+from branca.colormap import linear, LinearColormap
+from files.datasets import DatasetCache, EU_BROADBAND_WORKBOOK, EU_FIBRE_CSV
+from files.styles import make_styledict
+from files.geometry import registry
+from files.api import dumps
+from files.cube import Cube
+from files.tiles import make_tiles, tile_metadata
+from files.darkspots import load_darkspots, DARKSPOT_COLUMNS, DARKSPOT_MAP_COLUMN
+from files.postcodes import SPEED_MBIT, default_thresholds
+
+# Years predicted after the last observed one
+PREDICTION_YEARS = 7
+# Characters stripped from the year columns of the EU sheets ("8387900.0%", "1,234", "-")
+CLEAN_YEARS_TABLE = str.maketrans("", "", "-%, ")
 
 
 #########################
 #                      Backend                              #
 #########################
 class Backend:
-    def __init__(self):
+    def __init__(self, preload: bool = True):
+        self.datasets = DatasetCache()
+        self.parse_failures = None
+        if not preload:
+            # files.artifacts runs the stages below itself, spread over a process pool
+            return
+        self.load_eu_broadband()
+        self.load_eu_broadband_predictions()
+        self.load_eu_choropleth()
+        self.load_eu_choropleth_predictions()
+        # Short on memory, so lets load everything here so that it is only loaded once, at runtime
+        # This will allow the for the page to load quicker too
+        # TODO: move maps to top of app.py to prevent from needing to reload
+        self.choropleth_data = {
+            year: self.get_full_fibre_availability(year)
+            for year in self.datasets.ofcom_years()
+        }
+        # For graphs but not needed for the time being so commented out
+        self.load_constituencies_with_RUC()
+
+    def load_eu_broadband(self) -> gpd.geodataframe.GeoDataFrame:
         eu_broadband_df = self.get_europe_broadband_data()
-        eu_shp_gdf = self.load_europe_shapefile()
-        self.eu_broadband_geo = self.prepare_eu_gdf(eu_broadband_df, eu_shp_gdf)
-        self.eu_choropleth = self.get_choropleth_for_eu_broadband_with_slider(
-            self.eu_broadband_geo, "Percentage of households with FTTP availability"
+        self.eu_broadband_geo = self.prepare_eu_gdf(
+            eu_broadband_df, self.load_europe_shapefile()
         )
+        return self.eu_broadband_geo
 
+    def load_eu_broadband_predictions(self) -> gpd.geodataframe.GeoDataFrame:
         eu_broadband_predictions_df = self.eu_broadband_predictions(
             include_current=False
         )
-        eu_broadband_predictions_geo = self.prepare_eu_gdf(
-            eu_broadband_predictions_df, eu_shp_gdf
+        self.eu_broadband_predictions_geo = self.prepare_eu_gdf(
+            eu_broadband_predictions_df, self.load_europe_shapefile()
+        )
+        return self.eu_broadband_predictions_geo
+
+    def load_eu_choropleth(self):
+        self.eu_choropleth = self.get_choropleth_for_eu_broadband_with_slider(
+            self.eu_broadband_geo, "Percentage of households with FTTP availability"
         )
+
+    def load_eu_choropleth_predictions(self):
         self.eu_choropleth_predictions = (
             self.get_choropleth_for_eu_broadband_with_slider(
-                eu_broadband_predictions_geo, "FTTP", colormap=linear.PuRd_09
+                self.eu_broadband_predictions_geo, "FTTP", colormap=linear.PuRd_09
             )
         )
-        # Short on memory, so lets load everything here so that it is only loaded once, at runtime
-        # This will allow the for the page to load quicker too
-        # TODO: move maps to top of app.py to prevent from needing to reload
-        self.choropleth_data = []
-        for n, year in enumerate(range(2018, 2025)):
-            self.choropleth_data.append(
-                self.get_choropleth_for_full_fibre_availability(year, n)
-            )
-        # For graphs but not needed for the time being so commented out
+
+    def load_constituencies_with_RUC(self) -> gpd.geodataframe.GeoDataFrame:
         self.RUC_classifications = self.get_rural_urban_classifications()
         self.constituencies_with_RUC = self.get_constituencies_2022_with_RUC()
+        return self.constituencies_with_RUC
 
-    def clean_and_load_parldf(self, link_to_file: str) -> pd.core.frame.DataFrame:
-        ofcom_df = pd.read_csv(link_to_file, encoding="latin")
+    def clean_and_load_parldf(self, filename: str) -> pd.core.frame.DataFrame:
+        ofcom_df = self.datasets.load_ofcom(filename)
         ofcom_full_fibre_df = ofcom_df[
             ["parliamentary_constituency_name", "Full Fibre availability (% premises)"]
         ]
@@ -83,62 +106,53 @@ class Backend:
         return ofcom_full_fibre_df
 
     def load_ofcom_from_link(self, year: int) -> Optional[pd.core.frame.DataFrame]:
-        link = "https://raw.githubusercontent.com/yuliiabosher/Fiber-optic-project/refs/heads/parliamentary-constituencies"
-        filename = string.Template("${year}${n}_fixed_pcon_coverage_r${r}.csv")
-        files = {
-            2019: filename.substitute(year=2019, n="09", r="01"),
-            2020: filename.substitute(year=2020, n="09", r="01"),
-            2021: filename.substitute(year=2021, n="09", r="01"),
-            2022: filename.substitute(year=2022, n="09", r="02"),
-            2023: filename.substitute(year=2024, n="01", r="01"),
-        }
-        if year not in files:
+        filename = self.datasets.ofcom_filename(year)
+        if filename is None:
             return None
-        link_to_file = os.path.join(link, files[year])
-        return self.clean_and_load_parldf(link_to_file)
+        return self.clean_and_load_parldf(filename)
 
     def eu_broadband_predictions(
         self, include_current=False
     ) -> pd.core.frame.DataFrame:
-        fileEuropeData = "files/data/EUROPE_FIBRE.csv"
-
-        dfEuropeClean = self.prepare_df(fileEuropeData, "%")
-
-        cols = ["Country", "Metric", "URClass"]
-        dfEuropeCleanFTTP = dfEuropeClean.query('Metric == "FTTP"')
-
-        df_final_total = self.fn_calc(
-            dfEuropeCleanFTTP, "Total", string.Template("${year}%")
-        )
-
-        for year in range(2024, 2031):
-            df_final_total[f"FTTP{year}"].replace(np.nan, 0, inplace=True)
-
-        column_catalogue = {"FTTP%s" % year: str(year) for year in range(2024, 2031)}
-        extra_cols = {f"{year}%": str(year) for year in range(2018, 2024)}
-
-        if include_current:
-            column_catalogue.update(extra_cols)
-
-        df = self.fn_change_col_name(
-            df_final_total[["Country", "Metric"] + list(column_catalogue.keys())].query(
-                "Metric=='FTTP' & `Country` != 'EU27' & `Country` != 'EU28' & `Country` != 'Czechia'"
-            ),
-            column_catalogue,
-        )
-        eu_broadband_fttp_melted = df.melt(
-            id_vars=["Country", "Metric"], var_name="Year", value_name="FTTP"
-        )
-        eu_broadband_fttp_pivot = eu_broadband_fttp_melted.pivot(
-            index=["Country", "Year"], columns="Metric", values="FTTP"
+        cube = self.get_eu_fibre_cube()
+        countries = cube.regions[~np.isin(cube.regions, ["EU27", "EU28", "Czechia"])]
+        years = cube.years if include_current else cube.years[cube.years > 2023]
+        cube = cube.select(countries, years)
+        # A country without a prediction gets none of its households covered, and no
+        # prediction goes over 100%
+        fttp = cube["FTTP"]
+        fttp = np.where((cube.years > 2023) & np.isnan(fttp), 0, fttp)
+        cube["FTTP"] = np.where(fttp > 100, 100, fttp)
+        return cube.to_frame("Country", "Year", ["FTTP"])
+
+    def get_eu_fibre_cube(self) -> Cube:
+        # FTTP coverage (%) of every country, 2018 to 2023 and predicted after that
+        tidy = self.datasets.load_tidy(EU_FIBRE_CSV, self.read_europe_fibre_csv)
+        fttp = tidy[
+            (tidy["metric"].astype(str) == "FTTP")
+            & (tidy["geography_level"].astype(str) == "Total")
+            & tidy["year"].between(2018, 2023)
+        ]
+        cube = Cube.from_rows(
+            fttp["country"].astype(str), fttp["year"], fttp["metric"], fttp["value"]
         )
-        eu_broadband_fttp_pivot.reset_index(inplace=True)
-        eu_broadband_fttp_pivot.rename_axis(columns=None, inplace=True)
-        eu_broadband_fttp_pivot["Year"] = eu_broadband_fttp_pivot.Year.astype(int)
-        eu_broadband_fttp_pivot.FTTP = eu_broadband_fttp_pivot.FTTP.apply(
-            self.reduce_to_100
+        return self.predict(cube, "FTTP", range(2019, 2024))
+
+    def predict(self, cube: Cube, metric: str, years) -> Cube:
+        # The cube with the PREDICTION_YEARS after `years` added, where metric follows
+        # the straight line fitted through its values over `years` (as fn_calc does)
+        years = np.asarray(years, dtype=int)
+        predicted_years = np.arange(years[-1] + 1, years[-1] + 1 + PREDICTION_YEARS)
+        beta0, beta1 = self.fn_predict_five_year_batch(cube.select(years=years)[metric])
+        cube = cube.select(years=np.concatenate([cube.years, predicted_years]))
+        predicted = np.isin(cube.years, predicted_years)
+        values = cube[metric].copy()
+        values[:, predicted] = beta0[:, None] + beta1[:, None] * (
+            predicted_years - years[0]
         )
-        return eu_broadband_fttp_pivot
+        cube[metric] = values
+        cube.present[:, predicted] = True
+        return cube
 
     def fn_predict_five_year(self, yearly_values: list) -> Tuple[int]:
         year = np.arange(1, 6)
@@ -146,16 +160,58 @@ class Backend:
         beta1, beta0 = np.polyfit(year, value, 1)
         return beta0, beta1
 
+    def fn_predict_five_year_batch(
+        self, yearly_values: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # Same straight line fit as fn_predict_five_year, for every row of a
+        # (rows x 5) matrix at once using the closed form least squares solution
+        year = np.arange(1, yearly_values.shape[1] + 1, dtype=float)
+        year_centered = year - year.mean()
+        mean_values = yearly_values.mean(axis=1)
+        beta1 = (yearly_values - mean_values[:, None]) @ year_centered / (
+            year_centered @ year_centered
+        )
+        beta0 = mean_values - beta1 * year.mean()
+        # A row with any missing year has no fit, as np.polyfit returns nan for it
+        incomplete = np.isnan(yearly_values).any(axis=1)
+        beta0[incomplete] = np.nan
+        beta1[incomplete] = np.nan
+        return beta0, beta1
+
     def fn_clean_years(
         self, thisdf: pd.core.frame.DataFrame, columns: list
     ) -> pd.core.frame.DataFrame:
-        for column in thisdf.columns:
-            if column in columns:
-                replacement_dict = {"-": "", "%": "", ",": "", " ": ""}
-                for character, replacement in replacement_dict.items():
-                    thisdf[column] = thisdf[column].str.replace(character, replacement)
-                thisdf[column] = thisdf[column].replace("", None)
-                thisdf[column] = thisdf[column].astype(float)
+        # All year columns are cleaned as one stacked column, by a single str.translate
+        # and a single to_numeric, instead of several copies per column.
+        # "-", "%", "," and " " are stripped and empty cells become NaN, as before; cells
+        # that still are not numbers are reported instead of silently becoming NaN.
+        # Cells are parsed one by one: a quote or a line break in one of them can't run
+        # into the next as it would through a csv parser.
+        columns = [column for column in thisdf.columns if column in columns]
+        if not columns:
+            return thisdf
+        raw = thisdf[columns].to_numpy(dtype=object).ravel("F")
+        cells = raw.copy()
+        cells[pd.isna(raw)] = ""
+        cleaned = pd.Series(cells, dtype=object).astype(str).str.translate(
+            CLEAN_YEARS_TABLE
+        )
+        parsed = pd.to_numeric(cleaned, errors="coerce").astype(float)
+        failed = parsed.isna().to_numpy() & (cleaned != "").to_numpy()
+        if failed.any():
+            cols, rows = np.divmod(np.flatnonzero(failed), len(thisdf))
+            self.parse_failures = pd.DataFrame(
+                {
+                    "row": thisdf.index[rows],
+                    "column": np.asarray(columns, dtype=object)[cols],
+                    "value": raw[failed],
+                }
+            )
+            warnings.warn(
+                "%d values could not be parsed as numbers, see Backend.parse_failures:\n%s"
+                % (len(self.parse_failures), self.parse_failures.head(10).to_string(index=False))
+            )
+        thisdf[columns] = parsed.to_numpy(dtype=float).reshape(len(columns), len(thisdf)).T
         return thisdf
 
     def fn_change_col_name(
@@ -165,22 +221,42 @@ class Backend:
             thisdf.rename(columns={oldname: newname}, inplace=True)
         return thisdf
 
-    def prepare_df(self, file: str, suffix: str) -> pd.core.frame.DataFrame:
+    def read_europe_fibre_csv(self, file: str) -> pd.core.frame.DataFrame:
         df = pd.read_csv(file)
+        return self.fn_clean_years(df, [column for column in df.columns if column.isdigit()])
 
-        columns = {str(n): f"{n}{suffix}" for n in range(2018, 2024)}
-        dfClean = self.fn_clean_years(df, columns.keys())
-
-        columns.update({"Geography level": "URClass"})
+    def prepare_df(self, file: str, suffix: str) -> pd.core.frame.DataFrame:
+        tidy = self.datasets.load_tidy(file, self.read_europe_fibre_csv)
+        tidy = tidy[tidy["year"].between(2018, 2023)]
+        for column in ["country", "metric", "geography_level", "unit"]:
+            tidy[column] = tidy[column].astype(str)
+        dfClean = tidy.pivot(
+            index=["country", "metric", "geography_level", "unit"],
+            columns="year",
+            values="value",
+        )
+        dfClean.reset_index(inplace=True)
+        dfClean.rename_axis(columns=None, inplace=True)
+
+        columns = {n: f"{n}{suffix}" for n in range(2018, 2024)}
+        columns.update(
+            {
+                "country": "Country",
+                "metric": "Metric",
+                "unit": "Unit",
+                "geography_level": "URClass",
+            }
+        )
         dfClean = self.fn_change_col_name(dfClean, columns)
 
-        columns = ["Country", "Metric", "Unit"] + list(columns.values())
-        dfClean = dfClean[columns]
+        columns = ["Country", "Metric", "Unit"] + [
+            f"{n}{suffix}" for n in range(2018, 2024)
+        ]
+        dfClean = dfClean[columns + ["URClass"]]
         return dfClean
 
     def load_ofcom_pcodes(self):
-        linktofile = "https://raw.githubusercontent.com/yuliiabosher/Fiber-optic-project/refs/heads/parliamentary-constituencies/202401_fixed_pcon_coverage_r01.csv"
-        ofcom_df = pd.read_csv(linktofile, encoding="latin")
+        ofcom_df = self.datasets.load_ofcom_year(self.datasets.ofcom_years()[-1])
         ofcom_pc_codes_df = ofcom_df[["parliamentary_constituency_name", "parl_const"]]
         return ofcom_pc_codes_df
 
@@ -189,15 +265,27 @@ class Backend:
         df_final: pd.core.frame.DataFrame,
         urclass: Optional[str],
         row_template: str,
+        batched: bool = True,
+        years: list = range(2019, 2024),
     ) -> pd.core.frame.DataFrame:
+        # Fits the five observed years and predicts the PREDICTION_YEARS that follow them
         if urclass:
-            df_final = df_final.query('URClass == "' + urclass + '"')
-        catalogue_of_values = {year: [] for year in range(2024, 2031)}
-        first_year = 2019
+            df_final = df_final.query('URClass == "' + urclass + '"').copy()
+        first_year = years[0]
+        predicted_years = range(years[-1] + 1, years[-1] + 1 + PREDICTION_YEARS)
+        if batched:
+            yearly_values = df_final[
+                [row_template.substitute(year=year) for year in years]
+            ].to_numpy(dtype=float)
+            beta0, beta1 = self.fn_predict_five_year_batch(yearly_values)
+            for year in predicted_years:
+                df_final["FTTP%s" % year] = beta0 + beta1 * (year - first_year)
+            return df_final
+
+        # Row by row reference implementation, kept to check the batched fit against
+        catalogue_of_values = {year: [] for year in predicted_years}
         for _, row in df_final.iterrows():
-            rows = [
-                row[row_template.substitute(year=year)] for year in range(2019, 2024)
-            ]
+            rows = [row[row_template.substitute(year=year)] for year in years]
             beta0, beta1 = self.fn_predict_five_year(rows)
             for year in catalogue_of_values.keys():
                 x_year = year - first_year
@@ -211,33 +299,30 @@ class Backend:
     def get_choropleth_for_uk_broadband_with_slider(
         self, choropleth_data, colname, colormap=linear.YlOrRd_06
     ) -> Optional[folium.plugins.TimeSliderChoropleth]:
-        choropleth_data["year"] = [
-            int(datetime(year, 1, 1).timestamp())
-            for year in choropleth_data.index.values
-        ]
+        return self.make_time_slider_choropleth(
+            choropleth_data,
+            "PCON21CD",
+            choropleth_data.index.values,
+            colname,
+            colormap,
+        )
 
+    def make_time_slider_choropleth(
+        self, choropleth_data, key, years, colname, colormap
+    ) -> Tuple[folium.plugins.TimeSliderChoropleth, LinearColormap]:
         min_color = choropleth_data[colname].min()
         max_color = choropleth_data[colname].max()
-
         cmap = colormap.scale(min_color, max_color)
-        choropleth_data["opacity"] = [0.5 for i in range(choropleth_data.shape[0])]
-        choropleth_data["color"] = choropleth_data[colname].apply(cmap)
-
-        gdf = choropleth_data.drop_duplicates("PCON21CD")[["PCON21CD", "geometry"]]
-
-        gdf.set_index("PCON21CD", drop=True, inplace=True)
-        grouped_by = choropleth_data.groupby("PCON21CD")
-
-        styledata = dict()
-        for country in gdf.index:
-            group = grouped_by.get_group(country)
-            group = group[["year", "opacity", "color"]]
-            group.set_index("year", drop=True, inplace=True)
-            styledata[country] = group
 
-        styledict = {
-            country: data.to_dict(orient="index") for country, data in styledata.items()
-        }
+        styledict = make_styledict(
+            choropleth_data[key].to_numpy(),
+            years,
+            choropleth_data[colname].to_numpy(),
+            cmap,
+        )
+        # Get unique set of geometries, with the region as the index
+        gdf = choropleth_data.drop_duplicates(key)[[key, "geometry"]]
+        gdf.set_index(key, drop=True, inplace=True)
 
         choropleth_with_slider = folium.plugins.TimeSliderChoropleth(
             data=gdf, styledict=styledict, date_options="YYYY", highlight=True
@@ -255,13 +340,8 @@ class Backend:
         return dfRUC[["gss-code", "ruc-cluster-label"]]
 
     def get_constituencies_2022_with_RUC(self):
-        constituencies = gpd.read_file(
-            "files/data/Westminster_Parliamentary_Constituencies_Dec_2021_UK_BUC_2022_-8882165546947265805.zip"
-        )
-        constituencies_cleaned = constituencies[["PCON21CD", "PCON21NM", "geometry"]]
-        ofcom = pd.read_csv(
-            "files/data/202401_fixed_pcon_coverage_r01.csv", encoding="latin"
-        )
+        constituencies_cleaned = self.load_constituency_boundaries()
+        ofcom = self.datasets.load_ofcom_year(2023)
         ofcom_full_fibre = ofcom[
             [
                 "parl_const",
@@ -300,40 +380,18 @@ class Backend:
     def get_choropleth_for_eu_broadband_with_slider(
         self, choropleth_data, colname, colormap=linear.YlOrRd_06
     ) -> Optional[folium.plugins.TimeSliderChoropleth]:
-        choropleth_data["year"] = [
-            int(datetime(year, 1, 1).timestamp())
-            for year in choropleth_data.index.values
-        ]
-        choropleth_data.loc[
-            choropleth_data.loc[:]["Country"] == "United Kingdom", "Country"
-        ] = "uk"
-
-        min_color = choropleth_data[colname].min()
-        max_color = choropleth_data[colname].max()
-
-        cmap = colormap.scale(min_color, max_color)
-        choropleth_data["opacity"] = [0.5 for i in range(choropleth_data.shape[0])]
-        choropleth_data["color"] = choropleth_data[colname].apply(cmap)
-
-        gdf = choropleth_data.drop_duplicates("Country")[["Country", "geometry"]]
-
-        gdf.set_index("Country", drop=True, inplace=True)
-        grouped_by = choropleth_data.groupby("Country")
-
-        styledata = dict()
-        for country in gdf.index:
-            group = grouped_by.get_group(country)
-            group = group[["year", "opacity", "color"]]
-            group.set_index("year", drop=True, inplace=True)
-            styledata[country] = group
-
-        styledict = {
-            country: data.to_dict(orient="index") for country, data in styledata.items()
-        }
-        choropleth_with_slider = folium.plugins.TimeSliderChoropleth(
-            data=gdf, styledict=styledict, date_options="YYYY", highlight=True
+        # The slider map calls the United Kingdom "uk", on a copy: the frame itself is
+        # served by the values API, the tiles and /api/query under its real name
+        choropleth_data = choropleth_data.assign(
+            Country=choropleth_data["Country"].replace("United Kingdom", "uk")
+        )
+        return self.make_time_slider_choropleth(
+            choropleth_data,
+            "Country",
+            choropleth_data.index.values,
+            colname,
+            colormap,
         )
-        return choropleth_with_slider, cmap
 
     def check_filepath(self, file: str) -> bool:
         if not os.path.exists(file):
@@ -349,125 +407,109 @@ class Backend:
         return gpd.GeoDataFrame(eu_broadband_geo, geometry="geometry")
 
     def load_europe_shapefile(self):
-        country_polygons = gpd.read_file("files/data/CNTR_RG_01M_2024_4326.shp.zip")
-        country_polygons = country_polygons[["NAME_ENGL", "geometry"]]
-        return country_polygons
+        return registry.view("eu")
 
     def prepare_constituency_predictions(self, include_current=True):
-        ofcom_pc_codes_df = self.load_ofcom_pcodes()
-        final_df = None
-        for year in range(2019, 2024):
-            df = self.load_ofcom_from_link(year)
-            if isinstance(df, pd.core.frame.DataFrame):
-                if year == 2024:
-                    # problem with 2024, it should be named 2023 but iremains incorrect
-                    year -= 1
-                df.rename(
-                    columns={"Full Fibre availability (% premises)": "FTTP%s" % year},
-                    inplace=True,
-                )
-                if final_df is not None:
-                    final_df = final_df.merge(
-                        df, on=["parliamentary_constituency_name"], how="inner"
-                    )
-                else:
-                    final_df = df
-
-        final_df = final_df.merge(
-            ofcom_pc_codes_df, on=["parliamentary_constituency_name"], how="inner"
-        )
-        final_df = self.fn_calc(final_df, None, string.Template("FTTP${year}"))
-        final_df.drop(["parliamentary_constituency_name"], axis=1, inplace=True)
-        uk_broadband_fttp_melted = final_df.melt(
-            id_vars=["parl_const"], var_name="Year", value_name="FTTP"
-        )
-        uk_broadband_fttp_melted.reset_index(inplace=True)
-        uk_broadband_fttp_melted.rename_axis(columns=None, inplace=True)
-        uk_broadband_fttp_melted["Year"] = uk_broadband_fttp_melted.Year.str.replace(
-            "FTTP", ""
-        ).astype(int)
+        # kept for the values API, which serves the same predictions without geometry
+        self.constituency_predictions = self.get_constituency_predictions(
+            include_current
+        )
+        choropleth_data, cmap = self.get_choropleth_for_uk_broadband_with_slider(
+            self.constituency_predictions, "FTTP", colormap=linear.Purples_07
+        )
+        return choropleth_data, cmap
+
+    def get_constituency_predictions(
+        self, include_current=True
+    ) -> gpd.geodataframe.GeoDataFrame:
+        cube = self.get_uk_fttp_cube()
         if include_current == False:
-            uk_broadband_fttp_melted.drop(
-                uk_broadband_fttp_melted.loc[
-                    uk_broadband_fttp_melted.Year.isin(range(2018, 2024))
-                ].index,
-                axis=0,
-                inplace=True,
-            )
+            observed = self.datasets.ofcom_years()[-5:]
+            cube = cube.select(years=cube.years[~np.isin(cube.years, observed)])
+        fttp = cube["FTTP"]
+        cube["FTTP"] = np.where(fttp > 100, 100, fttp)
+        # Grouped by year, regions in the order of the oldest release
+        uk_broadband_fttp = cube.to_frame("parl_const", "Year", ["FTTP"], by="year")
 
         gdf = self.get_constituencies()
-        fibre_by_constituency_geo = uk_broadband_fttp_melted.merge(
+        fibre_by_constituency_geo = uk_broadband_fttp.merge(
             gdf, right_on="PCON21CD", left_on="parl_const"
         )
-        fibre_by_constituency_geo["FTTP"] = fibre_by_constituency_geo.FTTP.apply(
-            self.reduce_to_100
-        )
         fibre_by_constituency_geo.set_index("Year", inplace=True, drop=True)
         fibre_by_constituency_geo.drop(["PCON21NM", "parl_const"], axis=1, inplace=True)
         fibre_by_constituency_geo = gpd.GeoDataFrame(
             fibre_by_constituency_geo, geometry=fibre_by_constituency_geo.geometry
         )
-        choropleth_data, cmap = self.get_choropleth_for_uk_broadband_with_slider(
-            fibre_by_constituency_geo, "FTTP", colormap=linear.Purples_07
+        return fibre_by_constituency_geo
+
+    def get_uk_fttp_cube(self) -> Cube:
+        # Full fibre availability (% premises) by constituency code in the five most
+        # recent releases in files.catalogue, predicted for the years after them.
+        # Only constituencies found in every release and in the latest one's codes.
+        years = self.datasets.ofcom_years()[-5:]
+        names, rows_years, values = [], [], []
+        for year in years:
+            df = self.load_ofcom_from_link(year)
+            if isinstance(df, pd.core.frame.DataFrame):
+                names.append(df["parliamentary_constituency_name"].to_numpy())
+                rows_years.append(np.full(df.shape[0], year))
+                values.append(df["Full Fibre availability (% premises)"].to_numpy())
+        names = np.concatenate(names)
+        cube = Cube.from_rows(
+            names,
+            np.concatenate(rows_years),
+            np.full(len(names), "FTTP"),
+            np.concatenate(values),
+            sort=False,
         )
-        return choropleth_data, cmap
+        codes = self.load_ofcom_pcodes().drop_duplicates(
+            "parliamentary_constituency_name"
+        )
+        codes = codes.set_index("parliamentary_constituency_name")["parl_const"]
+        complete = cube.present.all(axis=1) & pd.Index(cube.regions).isin(codes.index)
+        cube = cube.select(cube.regions[complete])
+        cube = Cube(codes[cube.regions].to_numpy(), cube.years, cube.metrics)
+        return self.predict(cube, "FTTP", years)
 
-    def reduce_to_100(self, value):
-        if value > 100:
-            return 100
-        return value
+    def read_europe_broadband_workbook(self, file: str) -> pd.core.frame.DataFrame:
+        return pd.read_excel(file, sheet_name="Data", skiprows=6)
 
     def get_europe_broadband_data(self):
-        eu_broadband = pd.read_excel(
-            "files/data/Broadband_Coverage_in_Europe_2023_Final_dataset_20240905_fymrNtGW8v3HudBU9eUqxiEp30_106734.xlsx",
-            sheet_name="Data",
-            skiprows=6,
+        cube = self.get_eu_broadband_cube()
+        return cube.to_frame("Country", "Year", present_only=True)
+
+    def get_eu_broadband_cube(self) -> Cube:
+        # Households and households with FTTP of every country from 2018 to 2023
+        eu_broadband = self.datasets.load_tidy(
+            EU_BROADBAND_WORKBOOK, self.read_europe_broadband_workbook
         )
-        eu_columns = [
-            "Country",
-            "Metric",
-            "Geography level",
-            2018,
-            2019,
-            2020,
-            2021,
-            2022,
-            2023,
+        eu_broadband_total = eu_broadband[
+            (eu_broadband["geography_level"] == "Total")
+            & ~eu_broadband["country"].isin(["EU27", "EU28"])
+            & eu_broadband["metric"].isin(["FTTP", "Households"])
+            & eu_broadband["year"].between(2018, 2023)
         ]
-        eu_broadband = eu_broadband[eu_columns]
-        eu_broadband_total = eu_broadband.query('`Geography level` == "Total"').query(
-            '`Country` != "EU27" & `Country` != "EU28"'
-        )
-        eu_broadband_total.drop(columns=["Geography level"], inplace=True)
-        eu_broadband_FTTP_per_household = eu_broadband_total.query(
-            '`Metric` == "FTTP" | `Metric` == "Households"'
-        )
-        eu_broadband_fttp_melted = eu_broadband_FTTP_per_household.melt(
-            id_vars=["Country", "Metric"],
-            var_name="Year",
-            value_name="Number of households",
+        cube = Cube.from_rows(
+            eu_broadband_total["country"].astype(str),
+            eu_broadband_total["year"],
+            eu_broadband_total["metric"].astype(str),
+            eu_broadband_total["value"],
         )
-        eu_broadband_fttp_pivot = eu_broadband_fttp_melted.pivot(
-            index=["Country", "Year"], columns="Metric", values="Number of households"
+        cube["Percentage of households with FTTP availability"] = (
+            cube["FTTP"] / cube["Households"] * 100
         )
-        eu_broadband_fttp_pivot.reset_index(inplace=True)
-        eu_broadband_fttp_pivot.rename_axis(columns=None, inplace=True)
-        eu_broadband_fttp_pivot["Percentage of households with FTTP availability"] = (
-            eu_broadband_fttp_pivot["FTTP"]
-            / eu_broadband_fttp_pivot["Households"]
-            * 100
-        )
-        return eu_broadband_fttp_pivot
+        return cube
+
+    def load_constituency_boundaries(self) -> gpd.geodataframe.GeoDataFrame:
+        return registry.view("uk")
 
     def get_constituencies(self) -> gpd.geodataframe.GeoDataFrame:
-        constituencies = gpd.read_file(
-            "files/data/Westminster_Parliamentary_Constituencies_Dec_2021_UK_BUC_2022_-8882165546947265805.zip"
-        )
+        constituencies = self.load_constituency_boundaries()
         constituencies["PCON21NM"] = constituencies["PCON21NM"].str.upper().str.strip()
         return constituencies[["PCON21CD", "PCON21NM", "geometry"]]
 
-    def get_ofcom_full_fibre(self, file: str) -> pd.core.frame.DataFrame:
-        ofcom_df = pd.read_csv(file, encoding="latin")
+    def get_ofcom_full_fibre(self, filename: str) -> pd.core.frame.DataFrame:
+        ofcom_df = self.datasets.load_ofcom(filename)
         ofcom_df.rename(
             columns={
                 "parl_const_name": "parliamentary_constituency_name",
@@ -553,27 +595,22 @@ class Backend:
                     del choropleth._children[child]
         return choropleth
 
+    def get_full_fibre_availability(
+        self, year: int
+    ) -> Optional[gpd.geodataframe.GeoDataFrame]:
+        filename = self.datasets.ofcom_filename(year)
+        if filename is None:
+            return None
+        constituencies = self.get_constituencies()
+        ofcom = self.get_ofcom_full_fibre(filename)
+        return self.merge_ofcom_with_constituencies(ofcom, constituencies)
+
     def get_choropleth_for_full_fibre_availability(
         self, year: int, del_color_scale: bool = False
     ) -> Optional[folium.Choropleth]:
-        constituencies = self.get_constituencies()
-        link = "https://raw.githubusercontent.com/yuliiabosher/Fiber-optic-project/refs/heads/parliamentary-constituencies"
-        filename = string.Template("${year}${n}_fixed_pcon_coverage_r${r}.csv")
-        files = {
-            2018: filename.substitute(year=2018, n="09", r="01"),
-            2019: filename.substitute(year=2019, n="09", r="01"),
-            2020: filename.substitute(year=2020, n="09", r="01"),
-            2021: filename.substitute(year=2021, n="09", r="01"),
-            2022: filename.substitute(year=2022, n="09", r="02"),
-            2023: filename.substitute(year=2024, n="01", r="01"),
-        }
-        if year not in files:
+        fibre_by_constituency_geo_df = self.get_full_fibre_availability(year)
+        if fibre_by_constituency_geo_df is None:
             return None
-        link_to_file = os.path.join(link, files[year])
-        ofcom = self.get_ofcom_full_fibre(link_to_file)
-        fibre_by_constituency_geo_df = self.merge_ofcom_with_constituencies(
-            ofcom, constituencies
-        )
         choropleth = self.make_choropleth(
             fibre_by_constituency_geo_df,
             "Percentage of Premises with Full Fibre Availability",
@@ -587,54 +624,21 @@ class Backend:
         self, choropleth_data
     ) -> Optional[folium.plugins.TimeSliderChoropleth]:
         dfs = []
-        years = [2018, 2019, 2020, 2021, 2022, 2023]
-        for n, year in enumerate(years):
-            if choropleth_data[n]:
-                df = choropleth_data[n][1]
-                df["year"] = [
-                    int(datetime(year, 1, 1).timestamp()) for i in range(df.shape[0])
-                ]
+        for year, df in choropleth_data.items():
+            # one frame per year from get_full_fibre_availability, None when missing
+            if df is not None:
+                df["year"] = year
                 # append df to list of dfs
                 dfs.append(df)
 
         merged = gpd.GeoDataFrame(data=pd.concat(dfs))
-        # get min , max value of full fibre availability percentage
-        min_color = merged["Percentage of Premises with Full Fibre Availability"].min()
-        max_color = merged["Percentage of Premises with Full Fibre Availability"].max()
-
-        # Create a color scale from the min and max of the values
-        cmap = linear.PuRd_09.scale(min_color, max_color)
-        merged["opacity"] = [0.5 for i in range(merged.shape[0])]
-        merged["color"] = merged[
-            "Percentage of Premises with Full Fibre Availability"
-        ].apply(cmap)
-
-        # Get unique set of geometries, with constituency as the index
-        gdf = merged.drop_duplicates("Constituency Code")[
-            ["Constituency Code", "geometry"]
-        ]
-        gdf.set_index("Constituency Code", drop=True, inplace=True)
-
-        # group by constiuency
-        grouped_by = merged.groupby("Constituency Code")
-
-        # make a style dict with datetime, opacity and color for each entry in the group, indexed by constituency
-        styledata = dict()
-        for constituency in gdf.index:
-            group = grouped_by.get_group(constituency)
-            group = group[["year", "opacity", "color"]]
-            group.set_index("year", drop=True, inplace=True)
-            styledata[constituency] = group
-
-        # Use a dict comprehension to turn the dfs into dictionaries, maintaining the original key
-        styledict = {
-            constituency: data.to_dict(orient="index")
-            for constituency, data in styledata.items()
-        }
-        choropleth_with_slider = folium.plugins.TimeSliderChoropleth(
-            data=gdf, styledict=styledict, date_options="YYYY", highlight=True
+        return self.make_time_slider_choropleth(
+            merged,
+            "Constituency Code",
+            merged["year"].to_numpy(),
+            "Percentage of Premises with Full Fibre Availability",
+            linear.PuRd_09,
         )
-        return choropleth_with_slider, cmap
 
     def make_map_title(self, title: str, **kwargs) -> folium.Element:
         position = (
@@ -796,6 +800,8 @@ class Backend:
         m = folium.Map(
             location=[55.670249, 10.3333283], zoom_start=4, height=750, width=500
         )
+        if getattr(self, "eu_choropleth", None) is None:
+            self.load_eu_choropleth()
         choropleth_with_slider, colorbar1 = self.eu_choropleth
         choropleth_with_slider.add_to(m)
         colorbar1.add_to(m)
@@ -822,6 +828,8 @@ class Backend:
         m = folium.Map(
             location=[55.670249, 10.3333283], zoom_start=4, height=750, width=500
         )
+        if getattr(self, "eu_choropleth_predictions", None) is None:
+            self.load_eu_choropleth_predictions()
         choropleth_with_slider, colorbar1 = self.eu_choropleth_predictions
         choropleth_with_slider.add_to(m)
         colorbar1.add_to(m)
@@ -841,8 +849,14 @@ class Backend:
         return m.get_root()._repr_html_()
 
     def make_map_of_fibre_predictions_uk(self):
-        choropleth_with_slider, colorbar = self.prepare_constituency_predictions(
-            include_current=False
+        if getattr(self, "constituency_predictions", None) is None:
+            self.constituency_predictions = self.get_constituency_predictions(
+                include_current=False
+            )
+        choropleth_with_slider, colorbar = (
+            self.get_choropleth_for_uk_broadband_with_slider(
+                self.constituency_predictions, "FTTP", colormap=linear.Purples_07
+            )
         )
 
         m = folium.Map(
@@ -864,3 +878,291 @@ class Backend:
             els[i].style.border='2px solid black';els[i].style.overflow='hidden'};"""
         self.add_script_to_map(m, script)
         return m.get_root()._repr_html_()
+
+    def get_darkspots(self) -> pd.core.frame.DataFrame:
+        return load_darkspots()
+
+    def make_darkspots_map(self):
+        if getattr(self, "darkspots", None) is None:
+            self.darkspots = self.get_darkspots()
+        m = folium.Map(
+            location=[54.7023545, -3.2765753], zoom_start=6, height=750, width=500
+        )
+        if len(self.darkspots):
+            darkspots = self.get_constituencies().merge(
+                self.darkspots, left_on="PCON21CD", right_on="pcon"
+            )
+            choropleth_with_slider, colorbar = self.make_time_slider_choropleth(
+                darkspots,
+                "PCON21CD",
+                darkspots["year"].to_numpy(),
+                DARKSPOT_MAP_COLUMN,
+                linear.Blues_09,
+            )
+            colorbar.caption = "% of postcodes below the full fibre threshold"
+            choropleth_with_slider.add_to(m)
+            colorbar.add_to(m)
+        else:
+            # No postcode releases, or no postcode lookup to place them with
+            m.get_root().html.add_child(
+                self.make_map_title(
+                    "Postcode data not available",
+                    **{"position": "top:300px;left:150px"},
+                )
+            )
+        m.render()
+        m.get_root().width = "500px"
+        m.get_root().height = "800px"
+        m.get_root().html.add_child(
+            self.make_map_title(
+                "Full Fibre<br>dark spots<br>by constituency",
+                **{"position": "left:1px;bottom:0px"},
+            )
+        )
+        script = """els=document.getElementsByClassName('folium-map');for(var i=0;i<els.length;i++){
+            els[i].style.border='2px solid black';els[i].style.overflow='hidden'};"""
+        self.add_script_to_map(m, script)
+        return m.get_root()._repr_html_()
+
+    #########################
+    #             Data API payloads            #
+    #########################
+    def make_geometry_payload(self, gdf: gpd.geodataframe.GeoDataFrame) -> bytes:
+        # Feature ids are the region codes the values and colormap payloads are keyed by
+        return gdf[["geometry"]].to_json(drop_id=False, separators=(",", ":")).encode()
+
+    def make_values_payload(self, regions, years, values) -> dict:
+        # Columnar: one list of values per year, aligned with "regions"
+        region_codes, region_labels = pd.factorize(np.asarray(regions))
+        year_codes, year_labels = pd.factorize(np.asarray(years, dtype=int), sort=True)
+        grid = np.full((len(year_labels), len(region_labels)), np.nan)
+        grid[year_codes, region_codes] = np.asarray(values, dtype=float)
+        return {
+            "regions": region_labels.tolist(),
+            "years": year_labels.tolist(),
+            "values": [
+                [None if np.isnan(value) else round(value, 4) for value in row]
+                for row in grid.tolist()
+            ],
+        }
+
+    def make_colormap_payload(self, values, colormap) -> dict:
+        cmap = colormap.scale(np.nanmin(values), np.nanmax(values))
+        return {
+            "vmin": float(cmap.vmin),
+            "vmax": float(cmap.vmax),
+            "index": [float(value) for value in cmap.index],
+            "colors": [cmap(value) for value in cmap.index],
+        }
+
+    def get_metric_values(self) -> dict:
+        # metric -> (regions, years, values, colormap) exactly as drawn by its map
+        uk_years = [
+            (year, df) for year, df in self.choropleth_data.items() if df is not None
+        ]
+        if getattr(self, "constituency_predictions", None) is None:
+            self.constituency_predictions = self.get_constituency_predictions(
+                include_current=False
+            )
+        predictions = self.constituency_predictions
+        eu = self.eu_broadband_geo
+        eu_predictions = self.eu_broadband_predictions_geo
+        return {
+            "uk_fttp": (
+                np.concatenate([df["Constituency Code"].to_numpy() for _, df in uk_years]),
+                np.concatenate([np.full(df.shape[0], year) for year, df in uk_years]),
+                np.concatenate(
+                    [
+                        df["Percentage of Premises with Full Fibre Availability"].to_numpy()
+                        for _, df in uk_years
+                    ]
+                ),
+                linear.PuRd_09,
+            ),
+            "uk_fttp_predictions": (
+                predictions["PCON21CD"].to_numpy(),
+                predictions.index.values,
+                predictions["FTTP"].to_numpy(),
+                linear.Purples_07,
+            ),
+            "eu_fttp": (
+                eu["Country"].to_numpy(),
+                eu.index.values,
+                eu["Percentage of households with FTTP availability"].to_numpy(),
+                linear.YlOrRd_06,
+            ),
+            "eu_fttp_predictions": (
+                eu_predictions["Country"].to_numpy(),
+                eu_predictions.index.values,
+                eu_predictions["FTTP"].to_numpy(),
+                linear.PuRd_09,
+            ),
+        }
+
+    def make_darkspots_payload(self, darkspots: pd.core.frame.DataFrame) -> dict:
+        # Same columnar layout as the values payloads, one grid per dark spot column
+        payload = {
+            "thresholds": default_thresholds(),
+            "speed_mbit": SPEED_MBIT,
+            "regions": [],
+            "years": [],
+            "metrics": dict(),
+        }
+        for column in DARKSPOT_COLUMNS:
+            if column not in darkspots:
+                continue
+            values = self.make_values_payload(
+                darkspots["pcon"], darkspots["year"], darkspots[column]
+            )
+            payload["regions"], payload["years"] = values["regions"], values["years"]
+            payload["metrics"][column] = values["values"]
+        return payload
+
+    def make_api_payloads(self) -> dict:
+        # artifact name -> bytes, written by files.artifacts.build next to the maps
+        boundaries = {
+            "uk": self.get_constituencies().set_index("PCON21CD"),
+            "eu": self.eu_broadband_geo.drop_duplicates("Country").set_index("Country"),
+        }
+        payloads = {
+            "geometry/%s" % name: self.make_geometry_payload(gdf)
+            for name, gdf in boundaries.items()
+        }
+        for metric, (regions, years, values, colormap) in self.get_metric_values().items():
+            payloads["values/%s" % metric] = dumps(
+                self.make_values_payload(regions, years, values)
+            )
+            payloads["colormap/%s" % metric] = dumps(
+                self.make_colormap_payload(values, colormap)
+            )
+        if getattr(self, "darkspots", None) is None:
+            self.darkspots = self.get_darkspots()
+        payloads["darkspots"] = dumps(self.make_darkspots_payload(self.darkspots))
+        return payloads
+
+    #########################
+    #                Vector tiles                 #
+    #########################
+    def make_metric_columns(self, regions, years, values, prefix: str):
+        # One row per region and one column per year ("fttp_2023"...)
+        payload = self.make_values_payload(regions, years, values)
+        return pd.DataFrame(
+            np.array(payload["values"], dtype=float).T,
+            index=payload["regions"],
+            columns=["%s_%s" % (prefix, year) for year in payload["years"]],
+        )
+
+    def get_tile_layers(self) -> dict:
+        # Tile layer -> boundaries with the attributes its features carry. Every FTTP
+        # column is a percentage, the UK maps draw availability as a share of premises
+        values = self.get_metric_values()
+        uk = self.get_constituencies().rename(
+            columns={"PCON21CD": "code", "PCON21NM": "name"}
+        )
+        ruc = self.constituencies_with_RUC.set_index("Constituency Code")
+        uk["ruc"] = uk["code"].map(ruc["Urban/Rural Classification"])
+        eu = self.eu_broadband_geo.drop_duplicates("Country")[["Country", "geometry"]]
+        eu = eu.rename(columns={"Country": "name"}).reset_index(drop=True)
+        layers = {
+            "constituencies": (uk, "code", {"uk_fttp": 100, "uk_fttp_predictions": 1}),
+            "countries": (eu, "name", {"eu_fttp": 1, "eu_fttp_predictions": 1}),
+        }
+        for name, (gdf, key, scales) in layers.items():
+            for metric, scale in scales.items():
+                regions, years, metric_values, _ = values[metric]
+                prefix = "fttp_predicted" if metric.endswith("predictions") else "fttp"
+                metric_values = np.asarray(metric_values, dtype=float) * scale
+                columns = self.make_metric_columns(
+                    regions, years, metric_values, prefix
+                )
+                gdf = gdf.join(columns.round(2), on=key)
+            layers[name] = gdf
+        return layers
+
+    def make_vector_tiles(self, tile_layers: dict) -> dict:
+        # layer -> (MBTiles metadata, tiles), written by files.artifacts.build
+        tiles = dict()
+        for name, gdf in self.get_tile_layers().items():
+            spec = tile_layers[name]
+            minzoom, maxzoom = spec["minzoom"], spec["maxzoom"]
+            tiles[name] = (
+                tile_metadata(name, gdf, minzoom, maxzoom),
+                make_tiles(name, gdf, minzoom, maxzoom),
+            )
+        return tiles
+
+    #########################
+    #            Constituency lookup           #
+    #########################
+    def get_constituency_lookup(self) -> tuple:
+        # (boundaries, years) for files.lookup. The boundary file is read at full
+        # resolution so that an address next to a border lands on the right side of it;
+        # each constituency carries its latest and its last predicted FTTP.
+        attributes = self.get_tile_layers()["constituencies"].drop(columns="geometry")
+        observed = [column for column in attributes if column.startswith("fttp_20")]
+        predicted = [
+            column for column in attributes if column.startswith("fttp_predicted_")
+        ]
+        attributes = attributes[["code", "ruc"]].assign(
+            fttp=attributes[observed[-1]], fttp_predicted=attributes[predicted[-1]]
+        )
+        path = registry.boundary_sets["uk"]["path"]
+        boundaries = gpd.read_file(path)[["PCON21CD", "PCON21NM", "geometry"]]
+        boundaries = boundaries.to_crs("EPSG:4326").rename(
+            columns={"PCON21CD": "code", "PCON21NM": "name"}
+        )
+        years = {
+            "fttp": int(observed[-1].rsplit("_", 1)[1]),
+            "fttp_predicted": int(predicted[-1].rsplit("_", 1)[1]),
+        }
+        return boundaries.merge(attributes, on="code", how="left"), years
+
+    #########################
+    #               Query tables                 #
+    #########################
+    def get_query_tables(self) -> dict:
+        # table -> frame served by /api/query (files.query), FTTP as percentages. The
+        # yearly tables are sorted by year, which first/last/change aggregates rely on.
+        constituencies = pd.DataFrame(
+            {
+                "code": self.constituencies_with_RUC["Constituency Code"],
+                "name": self.constituencies_with_RUC["Constituency Name"],
+                "ruc": self.constituencies_with_RUC["Urban/Rural Classification"],
+                "premises": self.constituencies_with_RUC["Total Premises"],
+                "fttp_premises": self.constituencies_with_RUC[
+                    "Premises with Full Fibre Availability"
+                ],
+                "fttp": self.constituencies_with_RUC[
+                    "Percentage of Premises with Full Fibre Availability"
+                ]
+                * 100,
+            }
+        )
+        values = self.get_metric_values()
+        yearly = {
+            "uk_fttp": ("code", {"uk_fttp": 100, "uk_fttp_predictions": 1}),
+            "eu_fttp": ("country", {"eu_fttp": 1, "eu_fttp_predictions": 1}),
+        }
+        tables = {"constituencies": constituencies}
+        for table, (key, scales) in yearly.items():
+            frames = []
+            for metric, scale in scales.items():
+                regions, years, metric_values, _ = values[metric]
+                frames.append(
+                    pd.DataFrame(
+                        {
+                            key: np.asarray(regions).astype(str),
+                            "year": np.asarray(years, dtype=int),
+                            "fttp": np.asarray(metric_values, dtype=float) * scale,
+                            "predicted": metric.endswith("predictions"),
+                        }
+                    )
+                )
+            frame = pd.concat(frames, ignore_index=True)
+            tables[table] = frame.sort_values(
+                ["year", key], kind="stable", ignore_index=True
+            )
+        # Names and RUC labels on every UK row, so that they can be filtered on
+        labels = constituencies.set_index("code")[["name", "ruc"]]
+        tables["uk_fttp"] = tables["uk_fttp"].join(labels, on="code")
+        return tables
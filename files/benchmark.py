@@ -0,0 +1,471 @@
+import os
+import sys
+import json
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+from time import perf_counter
+from datetime import datetime, timezone
+from typing import Callable, Optional
+from files.artifacts import MAPS, build, rss_bytes
+from files.catalogue import Catalogue
+
+DATA_DIR = "files/data"
+# Root of the repository, put on the path of the serving process timed by "index"
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Key columns of the synthetic copies -> separator before the copy number; codes get
+# no space so that they stay joinable across files (pcon_ruc.csv, Ofcom releases)
+SYNTHETIC_KEYS = {"PCON21CD": "", "PCON21NM": " ", "NAME_ENGL": " "}
+# Stages faster than this are not reported as regressions, their timing is mostly noise
+NOISE_SECONDS = 0.05
+
+# Serving start-up as gunicorn would do it: import app.py (DASHBOARD_MODE=artifacts) and
+# answer the page and every map it embeds
+INDEX_SCRIPT = """
+import json
+from time import perf_counter
+start = perf_counter()
+import app
+client = app.application.test_client()
+sizes = [len(client.get("/").data)]
+for name in app.reloader.store.names():
+    sizes.append(len(client.get("/maps/%s" % name).data))
+seconds = perf_counter() - start
+from files.benchmark import peak_rss_bytes
+print(json.dumps(dict(seconds=seconds, bytes=sum(sizes), peak=peak_rss_bytes())))
+"""
+
+
+#########################
+#                  Measurements                         #
+#########################
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets the peak resident set size (VmHWM) of the process
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def output_bytes(result) -> Optional[int]:
+    # Size of what a stage returns: in memory size of frames, length of rendered pages
+    # and payloads, GeoJSON and style data of folium sliders
+    if result is None:
+        return 0
+    if isinstance(result, str):
+        return len(result.encode("utf-8"))
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if hasattr(result, "memory_usage"):
+        return int(result.memory_usage(deep=True).sum())
+    if hasattr(result, "styledict"):
+        return len(result.data) + len(json.dumps(result.styledict))
+    if isinstance(result, dict):
+        result = list(result.values())
+    if isinstance(result, (list, tuple)):
+        sizes = [output_bytes(item) for item in result]
+        return sum(size for size in sizes if size is not None)
+    return None
+
+
+def measure(name: str, function: Callable, *args) -> tuple:
+    # Returns (result, record), the error instead of the result when the stage failed
+    reset_peak_rss()
+    before = rss_bytes()
+    start = perf_counter()
+    record = dict(name=name)
+    try:
+        result = function(*args)
+    except Exception as error:
+        result = None
+        record["error"] = repr(error)
+    record["seconds"] = round(perf_counter() - start, 4)
+    record["peak_rss_bytes"] = peak_rss_bytes()
+    record["rss_before_bytes"] = before
+    record["output_bytes"] = output_bytes(result) if "error" not in record else None
+    return result, record
+
+
+#########################
+#                     Stages                                #
+#########################
+def run_stages(data_dir: str = DATA_DIR, cold: bool = False) -> list:
+    # Every Backend stage, in the order the build runs them, on a single Backend so that
+    # each stage finds what the previous ones loaded. A failing stage (missing input
+    # file...) is recorded with its error and the stages depending on it fail after it.
+    import string
+    from files.backend import Backend
+    from files.datasets import DatasetCache, CACHE_DIR, EU_FIBRE_CSV
+    from files.geometry import registry
+
+    records = []
+
+    def stage(name, function, *args):
+        result, record = measure(name, function, *args)
+        records.append(record)
+        return result
+
+    cache_dir = tempfile.mkdtemp(prefix="benchmark-cache-") if cold else None
+    registry.invalidate()
+    default_cache_dir = registry.cache_dir
+    if cold:
+        registry.cache_dir = cache_dir
+    try:
+        bkd = Backend(preload=False)
+        # Only what is on disk: releases listed as remote would be downloaded
+        bkd.datasets = DatasetCache(data_dir, cache_dir or CACHE_DIR)
+        bkd.datasets.catalogue.remote = []
+        years = bkd.datasets.ofcom_years()
+
+        stage("boundaries", registry.frames)
+        stage("get_eu_broadband_cube", bkd.get_eu_broadband_cube)
+        stage("get_europe_broadband_data", bkd.get_europe_broadband_data)
+        stage("get_eu_fibre_cube", bkd.get_eu_fibre_cube)
+        stage("eu_broadband_predictions", bkd.eu_broadband_predictions, False)
+        stage("get_uk_fttp_cube", bkd.get_uk_fttp_cube)
+        fttp = stage(
+            "prepare_df",
+            lambda: bkd.prepare_df(EU_FIBRE_CSV, "%").query('Metric == "FTTP"'),
+        )
+        for batched in (True, False):
+            stage(
+                "fn_calc" if batched else "fn_calc[row by row]",
+                lambda: bkd.fn_calc(
+                    fttp.copy(), "Total", string.Template("${year}%"), batched
+                ),
+            )
+        stage("load_eu_broadband", bkd.load_eu_broadband)
+        stage("load_eu_broadband_predictions", bkd.load_eu_broadband_predictions)
+        stage(
+            "get_choropleth_for_eu_broadband_with_slider",
+            lambda: bkd.get_choropleth_for_eu_broadband_with_slider(
+                bkd.eu_broadband_geo, "Percentage of households with FTTP availability"
+            ),
+        )
+
+        bkd.choropleth_data = stage(
+            "get_full_fibre_availability",
+            lambda: {year: bkd.get_full_fibre_availability(year) for year in years},
+        )
+        stage(
+            "get_choropleth_for_full_fibre_availability",
+            bkd.get_choropleth_for_full_fibre_availability,
+            years[-1] if years else None,
+        )
+        stage(
+            "get_choropleth_for_full_fibre_availability_with_slider",
+            lambda: bkd.get_choropleth_for_full_fibre_availability_with_slider(
+                {year: df.copy() for year, df in bkd.choropleth_data.items()}
+            ),
+        )
+        stage("load_constituencies_with_RUC", bkd.load_constituencies_with_RUC)
+        stage(
+            "prepare_constituency_predictions",
+            bkd.prepare_constituency_predictions,
+            False,
+        )
+        stage(
+            "get_choropleth_for_uk_broadband_with_slider",
+            lambda: bkd.get_choropleth_for_uk_broadband_with_slider(
+                bkd.constituency_predictions, "FTTP"
+            ),
+        )
+        bkd.darkspots = stage("get_darkspots", bkd.get_darkspots)
+
+        for method in MAPS.values():
+            stage(method, getattr(bkd, method))
+        stage("make_api_payloads", bkd.make_api_payloads)
+    finally:
+        registry.cache_dir = default_cache_dir
+        registry.invalidate()
+        if cold:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return records
+
+
+def run_end_to_end(data_dir: str = DATA_DIR) -> list:
+    # The full artifact build into a scratch directory, then serving start-up from it
+    records = []
+    output_dir = tempfile.mkdtemp(prefix="benchmark-artifacts-")
+    try:
+        # serial, forced and offline, like the stages above
+        manifest, record = measure("build", build, output_dir, data_dir, 1, True, True)
+        if manifest is not None:
+            record["output_bytes"] = sum(
+                entry["bytes"]
+                for entry in list(manifest["maps"].values())
+                + list(manifest["api"].values())
+                + list(manifest.get("tiles", {}).values())
+                + list(manifest.get("lookup", {}).values())
+                + list(manifest.get("query", {}).values())
+            )
+        records.append(record)
+
+        record = dict(name="index")
+        env = dict(
+            os.environ,
+            DASHBOARD_MODE="artifacts",
+            ARTIFACTS_DIR=output_dir,
+            PYTHONPATH=os.pathsep.join(
+                [REPO_DIR] + [path for path in [os.getenv("PYTHONPATH")] if path]
+            ),
+        )
+        result = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", INDEX_SCRIPT],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode == 0:
+            index = json.loads(result.stdout.strip().splitlines()[-1])
+            record.update(
+                seconds=round(index["seconds"], 4),
+                peak_rss_bytes=index["peak"],
+                output_bytes=index["bytes"],
+            )
+        else:
+            record["error"] = result.stderr.strip().splitlines()[-1]
+        records.append(record)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return records
+
+
+#########################
+#              Synthetic inputs                         #
+#########################
+def replicate(df, copies: int, columns: dict):
+    # copies x the rows of df; copy k > 0 suffixes the key columns with k, and shifts
+    # geometries 360 degrees east per copy so that no two copies overlap
+    import pandas as pd
+    import geopandas as gpd
+
+    frames = []
+    for k in range(copies):
+        copy = df.copy()
+        if k:
+            for column, separator in columns.items():
+                copy[column] = copy[column].astype(str) + "%s%d" % (separator, k)
+            if isinstance(copy, gpd.GeoDataFrame):
+                copy = copy.set_geometry(copy.geometry.translate(xoff=360 * k))
+        frames.append(copy)
+    combined = pd.concat(frames, ignore_index=True)
+    if isinstance(df, gpd.GeoDataFrame):
+        combined = gpd.GeoDataFrame(combined, geometry="geometry", crs=df.crs)
+    return combined
+
+
+def extend_years(df, years: list, to_key: Callable):
+    # Adds the missing year columns before the first one present, copying its values
+    present = [year for year in years if to_key(year) in df.columns]
+    if not present:
+        return df
+    first = to_key(present[0])
+    position = list(df.columns).index(first)
+    for year in reversed([year for year in years if year < present[0]]):
+        df.insert(position, to_key(year), df[first])
+    return df
+
+
+def write_zipped_shapefile(gdf, path: str):
+    with tempfile.TemporaryDirectory() as tmp:
+        gdf.to_file(os.path.join(tmp, "boundaries.shp"))
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for file in sorted(os.listdir(tmp)):
+                archive.write(os.path.join(tmp, file), file)
+
+
+def make_synthetic(root: str, regions: int, years: int, source_dir: str = DATA_DIR):
+    # Writes <root>/files/data with regions x the constituencies and countries of
+    # source_dir, and Ofcom releases and EU columns for the `years` years up to the last
+    # one in source_dir. Files the pipeline does not read (postcode releases...) are
+    # left out. Run the stages with root as the working directory.
+    import pandas as pd
+    import geopandas as gpd
+    from files.geometry import BOUNDARY_SETS
+    from files.datasets import EU_BROADBAND_WORKBOOK, EU_FIBRE_CSV
+
+    data_dir = os.path.join(root, DATA_DIR)
+    os.makedirs(data_dir, exist_ok=True)
+
+    def target(path):
+        return os.path.join(data_dir, os.path.basename(path))
+
+    def source(path):
+        return os.path.join(source_dir, os.path.basename(path))
+
+    for name, spec in BOUNDARY_SETS.items():
+        if not os.path.exists(source(spec["path"])):
+            continue
+        gdf = gpd.read_file(source(spec["path"]))[spec["columns"]]
+        keys = {
+            column: SYNTHETIC_KEYS[column]
+            for column in spec["columns"]
+            if column != "geometry"
+        }
+        write_zipped_shapefile(replicate(gdf, regions, keys), target(spec["path"]))
+
+    ruc = pd.read_csv(source("pcon_ruc.csv"))
+    replicate(ruc, regions, {"gss-code": "", "constituency-name": " "}).to_csv(
+        target("pcon_ruc.csv"), index=False
+    )
+
+    # Ofcom releases: the latest one scaled down towards the earlier years
+    releases = Catalogue(source_dir, remote=[]).releases("pcon")
+    last_year, template = max(releases.items())
+    ofcom = pd.read_csv(os.path.join(source_dir, template), encoding="latin")
+    ofcom = replicate(
+        ofcom, regions, {"parl_const": "", "parliamentary_constituency_name": " "}
+    )
+    for n, year in enumerate(range(last_year - years + 1, last_year + 1)):
+        release = ofcom.copy()
+        for column in [
+            "Full Fibre availability (% premises)",
+            "Number of premises with Full Fibre availability",
+        ]:
+            release[column] = release[column] * (n + 1) / years
+        # r02 wins over the r01 releases of files.catalogue.REMOTE_RELEASES
+        filename = "%d09_fixed_pcon_coverage_r02.csv" % year
+        if year == last_year:
+            filename = template
+        release.to_csv(os.path.join(data_dir, filename), index=False, encoding="latin")
+
+    eu_years = list(range(last_year - years + 1, last_year + 1))
+    workbook = pd.read_excel(
+        source(EU_BROADBAND_WORKBOOK), sheet_name="Data", skiprows=6
+    )
+    workbook = workbook[
+        [column for column in workbook.columns if not str(column).startswith("Unnamed")]
+    ]
+    workbook = replicate(workbook, regions, {"Country": " "})
+    workbook = extend_years(workbook, eu_years, int)
+    with pd.ExcelWriter(target(EU_BROADBAND_WORKBOOK)) as writer:
+        # the workbook is read with skiprows=6, under the notes of the published file
+        workbook.to_excel(writer, sheet_name="Data", startrow=6, index=False)
+
+    fibre = pd.read_csv(source(EU_FIBRE_CSV), dtype=str, keep_default_na=False)
+    fibre = extend_years(replicate(fibre, regions, {"Country": " "}), eu_years, str)
+    fibre.to_csv(target(EU_FIBRE_CSV), index=False)
+
+
+#########################
+#                     Reports                               #
+#########################
+def run_scenario(name: str, root: str, cold: bool = False, **scenario) -> dict:
+    # Stages and end to end timings with root as the working directory (files/data and
+    # the caches under it are relative paths)
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        start = perf_counter()
+        stages = run_stages(DATA_DIR, cold) + run_end_to_end(DATA_DIR)
+        seconds = round(perf_counter() - start, 3)
+    finally:
+        os.chdir(cwd)
+    return dict(name=name, cold=cold, seconds=seconds, stages=stages, **scenario)
+
+
+def compare(previous: dict, current: dict, tolerance: float) -> list:
+    # Stages at least `tolerance` times slower than in previous, same scenario and stage
+    before = {
+        (run["name"], stage["name"]): stage
+        for run in previous["runs"]
+        for stage in run["stages"]
+    }
+    regressions = []
+    for run in current["runs"]:
+        for stage in run["stages"]:
+            old = before.get((run["name"], stage["name"]))
+            if old is None or "error" in old or "error" in stage:
+                continue
+            if stage["seconds"] > max(old["seconds"] * tolerance, NOISE_SECONDS):
+                regressions.append(
+                    "%s %s: %.3fs -> %.3fs"
+                    % (run["name"], stage["name"], old["seconds"], stage["seconds"])
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Times every Backend stage, the artifact build and serving start-up"
+    )
+    parser.add_argument(
+        "--scenario", choices=["bundled", "synthetic", "all"], default="all"
+    )
+    parser.add_argument("--data", default=DATA_DIR, help="bundled data to run on")
+    parser.add_argument(
+        "--regions", type=int, default=10, help="synthetic: copies of every region"
+    )
+    parser.add_argument(
+        "--years", type=int, default=20, help="synthetic: years of Ofcom releases"
+    )
+    parser.add_argument(
+        "--cold", action="store_true", help="bundled: ignore the parsed data caches"
+    )
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="earlier --output to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+
+    report = dict(
+        created_at=datetime.now(timezone.utc).isoformat(),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        cpu_count=os.cpu_count(),
+        runs=[],
+    )
+    if args.scenario in ("bundled", "all"):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(args.data)))
+        report["runs"].append(run_scenario("bundled", root, args.cold))
+    if args.scenario in ("synthetic", "all"):
+        root = tempfile.mkdtemp(prefix="benchmark-synthetic-")
+        try:
+            make_synthetic(root, args.regions, args.years, args.data)
+            report["runs"].append(
+                run_scenario(
+                    "synthetic", root, regions=args.regions, years=args.years
+                )
+            )
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for run in report["runs"]:
+        print("%s (%.1fs)" % (run["name"], run["seconds"]))
+        for stage in run["stages"]:
+            print(
+                "  %-56s %8.3fs %8s MB peak %10s bytes%s"
+                % (
+                    stage["name"],
+                    stage.get("seconds", 0),
+                    "-"
+                    if stage.get("peak_rss_bytes") is None
+                    else "%.0f" % (stage["peak_rss_bytes"] / 2**20),
+                    stage.get("output_bytes") or "-",
+                    "  %s" % stage["error"] if "error" in stage else "",
+                )
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for regression in regressions:
+            print("slower: %s" % regression)
+        sys.exit(1 if regressions else 0)
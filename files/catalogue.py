@@ -0,0 +1,80 @@
+import os
+import re
+import json
+from typing import Optional
+
+DATA_DIR = "files/data"
+
+# Ofcom publishes <year><month>_fixed_<level>_coverage_r<revision>.csv, "pcon" being
+# constituency aggregates and "pc" the postcode level files
+RELEASE_PATTERN = re.compile(
+    r"^(?P<year>\d{4})(?P<month>\d{2})_fixed_(?P<level>pcon|pc)_coverage_r(?P<revision>\d{2})\.csv$"
+)
+# Releases hosted on the project branch (files.datasets.OFCOM_URL) rather than shipped
+# under files/data; they are downloaded the first time they are used
+REMOTE_RELEASES = [
+    "201809_fixed_pcon_coverage_r01.csv",
+    "201909_fixed_pcon_coverage_r01.csv",
+    "202009_fixed_pcon_coverage_r01.csv",
+    "202109_fixed_pcon_coverage_r01.csv",
+    "202209_fixed_pcon_coverage_r02.csv",
+]
+
+
+def data_year(year: int, month: int) -> int:
+    # Releases published in the first half of a year (e.g. 202401) report the
+    # rollout at the end of the previous year
+    return year if month >= 7 else year - 1
+
+
+#########################
+#                  Dataset catalogue                    #
+#########################
+class Catalogue:
+    # Ofcom releases available to the dashboard, found by name under files/data, in
+    # checksums.json (cached releases) and in REMOTE_RELEASES. Adding a year is a matter
+    # of dropping its csv into files/data. When several releases describe the same year
+    # the most recent publication and revision wins.
+    def __init__(self, data_dir: str = DATA_DIR, remote: list = REMOTE_RELEASES):
+        self.data_dir = data_dir
+        self.remote = remote
+
+    def filenames(self) -> list:
+        names = set(self.remote)
+        if os.path.isdir(self.data_dir):
+            names.update(os.listdir(self.data_dir))
+        checksums = os.path.join(self.data_dir, "checksums.json")
+        if os.path.exists(checksums):
+            with open(checksums) as f:
+                names.update(json.load(f))
+        return sorted(names)
+
+    def releases(self, level: str = "pcon") -> dict:
+        # year described -> filename of the release to use for it
+        found = dict()
+        for filename in self.filenames():
+            match = RELEASE_PATTERN.match(filename)
+            if match is None or match["level"] != level:
+                continue
+            if level == "pc" and not os.path.exists(
+                os.path.join(self.data_dir, filename)
+            ):
+                # postcode files are only ever read from disk
+                continue
+            published = (int(match["year"]), int(match["month"]), int(match["revision"]))
+            year = data_year(published[0], published[1])
+            if year not in found or published > found[year][0]:
+                found[year] = (published, filename)
+        return {year: found[year][1] for year in sorted(found)}
+
+    def ofcom_years(self) -> list:
+        return list(self.releases("pcon"))
+
+    def ofcom_filename(self, year: int) -> Optional[str]:
+        return self.releases("pcon").get(year)
+
+    def postcode_years(self) -> list:
+        return list(self.releases("pc"))
+
+    def postcode_filename(self, year: int) -> Optional[str]:
+        return self.releases("pc").get(year)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+
+class Cube:
+    # Region x year x metric values in dense arrays: the region and year labels are
+    # interned once and every metric is a float (regions x years) array over them, NaN
+    # where there is no value. Derived metrics are whole array expressions and adding
+    # one adds one array, nothing is reshaped or copied per metric.
+    # `present` marks the (region, year) pairs the source rows had, so that a frame
+    # made back from the cube has the rows a pivot of those rows would have had.
+    def __init__(
+        self,
+        regions,
+        years,
+        metrics: Optional[dict] = None,
+        present: Optional[np.ndarray] = None,
+    ):
+        self.regions = np.asarray(regions)
+        self.years = np.asarray(years, dtype=int)
+        self.shape = (len(self.regions), len(self.years))
+        self.metrics = dict()
+        for name, values in (metrics or dict()).items():
+            self[name] = values
+        self.present = np.ones(self.shape, dtype=bool) if present is None else present
+
+    @classmethod
+    def from_rows(cls, regions, years, metrics, values, sort: bool = True) -> "Cube":
+        # One value per row, as in a tidy table (region, year, metric, value). Regions
+        # are sorted like a pivot would, or kept in order of first appearance.
+        region_codes, region_labels = pd.factorize(np.asarray(regions), sort=sort)
+        year_codes, year_labels = pd.factorize(np.asarray(years, dtype=int), sort=True)
+        metric_codes, metric_labels = pd.factorize(np.asarray(metrics), sort=True)
+        shape = (len(metric_labels), len(region_labels), len(year_labels))
+        data = np.full(shape, np.nan)
+        data[metric_codes, region_codes, year_codes] = np.asarray(values, dtype=float)
+        present = np.zeros(data.shape[1:], dtype=bool)
+        present[region_codes, year_codes] = True
+        return cls(region_labels, year_labels, dict(zip(metric_labels, data)), present)
+
+    def __getitem__(self, metric: str) -> np.ndarray:
+        return self.metrics[metric]
+
+    def __setitem__(self, metric: str, values):
+        self.metrics[metric] = np.broadcast_to(
+            np.asarray(values, dtype=float), self.shape
+        )
+
+    def __contains__(self, metric: str) -> bool:
+        return metric in self.metrics
+
+    def select(self, regions=None, years=None) -> "Cube":
+        # The cube over some of the regions and years (missing years are added empty),
+        # region order is kept
+        rows = np.arange(len(self.regions))
+        if regions is not None:
+            # hashed, np.isin sorts object arrays
+            rows = rows[pd.Index(self.regions).isin(regions)]
+        years = self.years if years is None else np.asarray(years, dtype=int)
+        columns = np.minimum(np.searchsorted(self.years, years), len(self.years) - 1)
+        found = self.years[columns] == years
+        index = np.ix_(rows, columns)
+        cube = Cube(self.regions[rows], years)
+        for name, values in self.metrics.items():
+            cube[name] = np.where(found, values[index], np.nan)
+        cube.present = self.present[index] & found
+        return cube
+
+    def to_frame(
+        self,
+        region: str,
+        year: str,
+        metrics: Optional[list] = None,
+        by: str = "region",
+        present_only: bool = False,
+    ) -> pd.core.frame.DataFrame:
+        # Long frame, one row per (region, year): grouped by region like a pivot, or by
+        # year like a melt
+        metrics = list(self.metrics) if metrics is None else metrics
+        regions, years = len(self.regions), len(self.years)
+        if by == "region":
+            data = {
+                region: np.repeat(self.regions, years),
+                year: np.tile(self.years, regions),
+            }
+            data.update({name: self[name].ravel() for name in metrics})
+            keep = self.present.ravel()
+        else:
+            data = {
+                region: np.tile(self.regions, years),
+                year: np.repeat(self.years, regions),
+            }
+            data.update({name: self[name].T.ravel() for name in metrics})
+            keep = self.present.T.ravel()
+        frame = pd.DataFrame(data)
+        if present_only and not keep.all():
+            frame = frame[keep].reset_index(drop=True)
+        return frame
@@ -0,0 +1,38 @@
+import warnings
+from typing import Optional
+import pandas as pd
+from files.postcodes import PostcodeCoverage
+
+# Constituencies where postcodes fall below the full fibre and speed thresholds of
+# files.postcodes (POSTCODE_FTTP_THRESHOLD, POSTCODE_SPEED_THRESHOLD at
+# POSTCODE_SPEED_MBIT), per year, as served under /api/darkspots
+DARKSPOT_COLUMNS = [
+    "postcodes",
+    "premises",
+    "fttp_postcodes_below",
+    "fttp_premises_below",
+    "fttp_postcodes_share_below",
+    "fttp_premises_share_below",
+    "speed_postcodes_below",
+    "speed_premises_below",
+    "speed_postcodes_share_below",
+    "speed_premises_share_below",
+]
+# Column drawn by the dark spots map
+DARKSPOT_MAP_COLUMN = "fttp_postcodes_share_below"
+
+
+def load_darkspots(
+    years: Optional[list] = None, coverage: Optional[PostcodeCoverage] = None
+) -> pd.core.frame.DataFrame:
+    # One row per constituency and year with a postcode release under files/data.
+    # Years already aggregated are read from their cached tables, so a new Ofcom
+    # release only streams that release. Empty when there is nothing to aggregate.
+    coverage = PostcodeCoverage() if coverage is None else coverage
+    years = coverage.catalogue.postcode_years() if years is None else years
+    try:
+        return coverage.load_years(years)
+    except FileNotFoundError as error:
+        # postcode releases are present but the postcode -> constituency lookup is not
+        warnings.warn("Dark spots skipped: %s" % error)
+        return pd.DataFrame(columns=["year", "pcon"])
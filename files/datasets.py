@@ -0,0 +1,185 @@
+import os
+import json
+import fcntl
+import urllib.request
+from typing import Callable, Optional
+import pandas as pd
+from files.artifacts import file_sha256, temp_path, write_atomic
+from files.catalogue import Catalogue
+from files.metrics import metrics
+
+DATA_DIR = "files/data"
+CACHE_DIR = os.getenv("DATASET_CACHE_DIR", "files/data/cache")
+
+OFCOM_URL = "https://raw.githubusercontent.com/yuliiabosher/Fiber-optic-project/refs/heads/parliamentary-constituencies"
+EU_BROADBAND_WORKBOOK = os.path.join(
+    DATA_DIR,
+    "Broadband_Coverage_in_Europe_2023_Final_dataset_20240905_fymrNtGW8v3HudBU9eUqxiEp30_106734.xlsx",
+)
+EU_FIBRE_CSV = os.path.join(DATA_DIR, "EUROPE_FIBRE.csv")
+# Wide source column -> tidy column, every other column named after a year holds values
+TIDY_KEYS = {
+    "Country": "country",
+    "Metric": "metric",
+    "Geography level": "geography_level",
+    "Unit": "unit",
+}
+
+
+#########################
+#                  Dataset cache                         #
+#########################
+class DatasetCache:
+    # Raw Ofcom CSVs are kept under files/data and pinned by sha256 in checksums.json.
+    # Each one is parsed once into cache/<sha256>.parquet and every later load reads that
+    # file, so a release fetched once is available offline and never parsed twice.
+    def __init__(self, data_dir: str = DATA_DIR, cache_dir: str = CACHE_DIR):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.checksums_file = os.path.join(data_dir, "checksums.json")
+        self.checksums = self.load_checksums()
+        self.catalogue = Catalogue(data_dir)
+        self._frames = dict()
+
+    def load_checksums(self) -> dict:
+        if not os.path.exists(self.checksums_file):
+            return dict()
+        with open(self.checksums_file) as f:
+            return json.load(f)
+
+    def register_checksum(self, filename: str, digest: str):
+        if self.checksums.get(filename) == digest:
+            return
+        # Other processes (the build's workers) pin files too: merge into what is on
+        # disk now, under a lock, rather than writing back this process' copy
+        os.makedirs(self.data_dir, exist_ok=True)
+        with open("%s.lock" % self.checksums_file, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                checksums = self.load_checksums()
+                checksums[filename] = digest
+                write_atomic(
+                    self.checksums_file,
+                    json.dumps(checksums, indent=2, sort_keys=True).encode(),
+                )
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        self.checksums = checksums
+
+    def ofcom_years(self) -> list:
+        return self.catalogue.ofcom_years()
+
+    def ofcom_filename(self, year: int) -> Optional[str]:
+        return self.catalogue.ofcom_filename(year)
+
+    def download(self, filename: str, path: str):
+        link_to_file = "%s/%s" % (OFCOM_URL, filename)
+        tmp = temp_path(path)
+        try:
+            with urllib.request.urlopen(link_to_file, timeout=60) as response, open(
+                tmp, "wb"
+            ) as f:
+                for chunk in iter(lambda: response.read(1 << 20), b""):
+                    f.write(chunk)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        digest = file_sha256(tmp)
+        expected = self.checksums.get(filename)
+        if expected is not None and digest != expected:
+            os.remove(tmp)
+            raise ValueError(
+                "Checksum mismatch for %s: expected %s, got %s"
+                % (link_to_file, expected, digest)
+            )
+        os.replace(tmp, path)
+
+    def parquet_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, "%s.parquet" % digest)
+
+    def resolve(self, filename: str) -> str:
+        path = os.path.join(self.data_dir, filename)
+        expected = self.checksums.get(filename)
+        if os.path.exists(path):
+            digest = file_sha256(path)
+            if expected is not None and digest != expected:
+                raise ValueError(
+                    "Checksum mismatch for %s: expected %s, got %s"
+                    % (path, expected, digest)
+                )
+        elif expected is not None and os.path.exists(self.parquet_path(expected)):
+            # Raw copy was removed but its parsed table is still cached
+            return self.parquet_path(expected)
+        else:
+            self.download(filename, path)
+            metrics.inc("dashboard_downloads_total")
+            digest = file_sha256(path)
+        self.register_checksum(filename, digest)
+
+        parquet = self.parquet_path(digest)
+        if os.path.exists(parquet):
+            metrics.inc("dashboard_cache_lookups_total", cache="ofcom", result="disk")
+        else:
+            metrics.inc("dashboard_cache_lookups_total", cache="ofcom", result="miss")
+            os.makedirs(self.cache_dir, exist_ok=True)
+            df = pd.read_csv(path, encoding="latin")
+            tmp = temp_path(parquet)
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, parquet)
+        return parquet
+
+    def load_ofcom(self, filename: str) -> pd.core.frame.DataFrame:
+        if filename not in self._frames:
+            parquet = self.resolve(filename)
+            self._frames[filename] = pd.read_parquet(parquet)
+            metrics.inc(
+                "dashboard_loaded_bytes_total",
+                os.path.getsize(parquet),
+                source=filename,
+            )
+        else:
+            metrics.inc("dashboard_cache_lookups_total", cache="ofcom", result="memory")
+        # callers rename and reassign columns in place, so never hand out the cached frame
+        return self._frames[filename].copy()
+
+    def load_ofcom_year(self, year: int) -> Optional[pd.core.frame.DataFrame]:
+        filename = self.ofcom_filename(year)
+        if filename is None:
+            return None
+        return self.load_ofcom(filename)
+
+    def to_tidy(self, wide: pd.core.frame.DataFrame) -> pd.core.frame.DataFrame:
+        years = [column for column in wide.columns if str(column).isdigit()]
+        tidy = wide[list(TIDY_KEYS) + years].melt(
+            id_vars=list(TIDY_KEYS), var_name="year", value_name="value"
+        )
+        tidy.rename(columns=TIDY_KEYS, inplace=True)
+        tidy["year"] = tidy["year"].astype(int).astype("int16")
+        tidy["value"] = tidy["value"].astype(float)
+        # stored as dictionary encoded columns in the parquet file
+        for column in TIDY_KEYS.values():
+            tidy[column] = tidy[column].astype("category")
+        return tidy
+
+    def load_tidy(self, path: str, parse: Callable) -> pd.core.frame.DataFrame:
+        # parse(path) returns the source as a wide frame with the TIDY_KEYS columns and
+        # one numeric column per year. It only runs when the source file changed.
+        if path not in self._frames:
+            parquet = os.path.join(self.cache_dir, "tidy-%s.parquet" % file_sha256(path))
+            result = "disk" if os.path.exists(parquet) else "miss"
+            if result == "miss":
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp = temp_path(parquet)
+                self.to_tidy(parse(path)).to_parquet(tmp, index=False)
+                os.replace(tmp, parquet)
+            self._frames[path] = pd.read_parquet(parquet)
+            metrics.inc(
+                "dashboard_loaded_bytes_total",
+                os.path.getsize(parquet),
+                source=os.path.basename(path),
+            )
+        else:
+            result = "memory"
+        metrics.inc("dashboard_cache_lookups_total", cache="tidy", result=result)
+        return self._frames[path].copy()
+
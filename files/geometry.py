@@ -0,0 +1,160 @@
+import os
+import json
+import numpy as np
+import shapely
+import geopandas as gpd
+from files.artifacts import file_sha256, temp_path, write_atomic
+from files.datasets import CACHE_DIR
+from files.metrics import metrics
+
+# Zoom level a map opens at -> Douglas-Peucker tolerance and coordinate grid, in degrees.
+# A map uses the closest tier at or below its zoom_start.
+SIMPLIFY_TIERS = {
+    4: dict(tolerance=0.01, grid_size=0.001),
+    6: dict(tolerance=0.002, grid_size=0.0001),
+    8: dict(tolerance=0.0005, grid_size=0.00001),
+}
+
+
+def tier_for_zoom(zoom: int) -> dict:
+    levels = [level for level in sorted(SIMPLIFY_TIERS) if level <= zoom]
+    return SIMPLIFY_TIERS[levels[-1] if levels else min(SIMPLIFY_TIERS)]
+
+
+def simplify_coverage(
+    gdf: gpd.geodataframe.GeoDataFrame, tolerance: float, grid_size: float
+) -> gpd.geodataframe.GeoDataFrame:
+    # coverage_simplify simplifies every shared border once for both polygons that use it,
+    # so neighbouring constituencies/countries never open gaps or overlap
+    if hasattr(shapely, "coverage_simplify"):
+        simplified = shapely.coverage_simplify(gdf.geometry.values, tolerance)
+    else:
+        simplified = shapely.simplify(
+            gdf.geometry.values, tolerance, preserve_topology=True
+        )
+    # Snap to a grid so shared vertices stay shared, then round so the GeoJSON
+    # written by folium only carries the digits the grid needs
+    decimals = max(0, int(round(-np.log10(grid_size))))
+    quantized = shapely.set_precision(simplified, grid_size)
+    quantized = shapely.transform(quantized, lambda coords: np.round(coords, decimals))
+    # Islands smaller than a grid cell collapse, keep their simplified outline instead
+    collapsed = shapely.is_empty(quantized)
+    quantized[collapsed] = simplified[collapsed]
+
+    gdf = gdf.copy()
+    gdf.geometry = quantized
+    return gdf
+
+
+def load_boundaries(
+    path: str, columns: list, zoom: int, cache_dir: str = CACHE_DIR
+) -> tuple:
+    tier = tier_for_zoom(zoom)
+    name = "%s-%s-%s" % (file_sha256(path), tier["tolerance"], tier["grid_size"])
+    cached = os.path.join(cache_dir, "%s.parquet" % name)
+    report_file = os.path.join(cache_dir, "%s.json" % name)
+    if os.path.exists(cached) and os.path.exists(report_file):
+        metrics.inc("dashboard_cache_lookups_total", cache="boundaries", result="disk")
+        metrics.inc(
+            "dashboard_loaded_bytes_total",
+            os.path.getsize(cached),
+            source=os.path.basename(path),
+        )
+        with open(report_file) as f:
+            return gpd.read_parquet(cached), json.load(f)
+
+    metrics.inc("dashboard_cache_lookups_total", cache="boundaries", result="miss")
+    gdf = gpd.read_file(path)[columns].to_crs("EPSG:4326")
+    simplified = simplify_coverage(gdf, **tier)
+    report = dict(
+        source=os.path.basename(path),
+        zoom=zoom,
+        raw_bytes=len(gdf.to_json()),
+        simplified_bytes=len(simplified.to_json()),
+        **tier,
+    )
+    report["saved_bytes"] = report["raw_bytes"] - report["simplified_bytes"]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = temp_path(cached)
+    simplified.to_parquet(tmp)
+    os.replace(tmp, cached)
+    write_atomic(report_file, json.dumps(report, indent=2).encode())
+    return simplified, report
+
+
+#########################
+#               Geometry registry                     #
+#########################
+# Boundary set -> file, columns kept and zoom tier it is simplified for
+BOUNDARY_SETS = {
+    "uk": dict(
+        path="files/data/Westminster_Parliamentary_Constituencies_Dec_2021_UK_BUC_2022_-8882165546947265805.zip",
+        columns=["PCON21CD", "PCON21NM", "geometry"],
+        zoom=6,
+    ),
+    "eu": dict(
+        path="files/data/CNTR_RG_01M_2024_4326.shp.zip",
+        columns=["NAME_ENGL", "geometry"],
+        zoom=4,
+    ),
+}
+
+
+class GeometryRegistry:
+    # Each boundary set is parsed once per process (from its GeoParquet cache when one
+    # exists) and every caller gets a shallow view of that single frame. Views share the
+    # geometry arrays, so adding, renaming or dropping columns on a view is free, but
+    # values must not be written in place.
+    def __init__(self, boundary_sets: dict = BOUNDARY_SETS, cache_dir: str = CACHE_DIR):
+        self.boundary_sets = boundary_sets
+        self.cache_dir = cache_dir
+        self._frames = dict()
+        self._reports = dict()
+
+    def load(self, name: str) -> gpd.geodataframe.GeoDataFrame:
+        if name in self._frames:
+            metrics.inc(
+                "dashboard_cache_lookups_total", cache="boundaries", result="memory"
+            )
+        else:
+            spec = self.boundary_sets[name]
+            self._frames[name], self._reports[name] = load_boundaries(
+                spec["path"], spec["columns"], spec["zoom"], self.cache_dir
+            )
+        return self._frames[name]
+
+    def view(self, name: str) -> gpd.geodataframe.GeoDataFrame:
+        return self.load(name).copy(deep=False)
+
+    def report(self, name: str) -> dict:
+        self.load(name)
+        return self._reports.get(name, dict())
+
+    def seed(self, frames: dict, reports: dict = None):
+        # Hand over boundary sets already loaded by another process (see files.artifacts)
+        self._frames.update(frames)
+        self._reports.update(reports or dict())
+
+    def frames(self) -> dict:
+        return {name: self.load(name) for name in self.boundary_sets}
+
+    def reports(self) -> dict:
+        return dict(self._reports)
+
+    def invalidate(self, name: str = None, on_disk: bool = False):
+        # Forget parsed boundary sets; on_disk also removes their simplified GeoParquet
+        # copies so that the next load re-reads the source file
+        names = list(self.boundary_sets) if name is None else [name]
+        for name in names:
+            self._frames.pop(name, None)
+            self._reports.pop(name, None)
+            if on_disk and os.path.isdir(self.cache_dir):
+                prefix = file_sha256(self.boundary_sets[name]["path"])
+                for file in os.listdir(self.cache_dir):
+                    if file.startswith(prefix):
+                        os.remove(os.path.join(self.cache_dir, file))
+
+
+registry = GeometryRegistry()
+
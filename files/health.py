@@ -0,0 +1,153 @@
+import os
+import threading
+from collections import deque
+from time import time, sleep
+from typing import Optional
+
+SAMPLE_SECONDS = float(os.getenv("HEALTH_SAMPLE_SECONDS", 5))
+# Samples kept, 10 minutes at the default interval
+HISTORY = int(os.getenv("HEALTH_HISTORY", 120))
+# A newest sample older than this many intervals means the sampler stopped
+STALE_INTERVALS = float(os.getenv("HEALTH_STALE_INTERVALS", 3))
+POWER_SUPPLY_DIR = "/sys/class/power_supply"
+MEMINFO_FIELDS = {
+    "MemTotal": "total",
+    "MemFree": "free",
+    "MemAvailable": "available",
+    "Buffers": "buffers",
+    "Cached": "cached",
+    "SwapTotal": "swap_total",
+    "SwapFree": "swap_free",
+}
+STATUS_FIELDS = {"VmRSS": "rss", "VmHWM": "peak_rss", "Threads": "threads"}
+
+
+#########################
+#                     Readings                             #
+#########################
+def read_text(path: str) -> Optional[str]:
+    # None when the file does not exist on this machine (no battery, no /proc...)
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def read_fields(path: str, fields: dict) -> dict:
+    # "Name:   value [kB]" lines, sizes in bytes
+    values = dict.fromkeys(fields.values())
+    for line in (read_text(path) or "").splitlines():
+        name, _, value = line.partition(":")
+        if name in fields:
+            value = value.split()
+            size = int(value[0])
+            values[fields[name]] = size * 1024 if value[1:] == ["kB"] else size
+    return values
+
+
+def read_memory() -> dict:
+    memory = read_fields("/proc/meminfo", MEMINFO_FIELDS)
+    if memory["total"] is not None and memory["available"] is not None:
+        memory["used"] = memory["total"] - memory["available"]
+    return memory
+
+
+def read_load() -> dict:
+    fields = (read_text("/proc/loadavg") or "").split()
+    if len(fields) < 4:
+        return dict(load_1=None, load_5=None, load_15=None, running=None, processes=None)
+    running, processes = fields[3].split("/")
+    return dict(
+        load_1=float(fields[0]),
+        load_5=float(fields[1]),
+        load_15=float(fields[2]),
+        running=int(running),
+        processes=int(processes),
+    )
+
+
+def read_uptime() -> Optional[float]:
+    uptime = read_text("/proc/uptime")
+    return float(uptime.split()[0]) if uptime else None
+
+
+def read_power_supplies(directory: str = POWER_SUPPLY_DIR) -> dict:
+    # Every supply the kernel reports (BAT0, AC, usb...), empty on a Pi without one
+    supplies = dict()
+    if not os.path.isdir(directory):
+        return supplies
+    for name in sorted(os.listdir(directory)):
+        supply = dict()
+        for field in ("type", "status", "capacity", "online"):
+            value = read_text(os.path.join(directory, name, field))
+            if value is not None:
+                supply[field] = int(value) if value.isdigit() else value
+        supplies[name] = supply
+    return supplies
+
+
+def take_sample() -> dict:
+    supplies = read_power_supplies()
+    batteries = [s for s in supplies.values() if s.get("type") == "Battery"]
+    return dict(
+        ts=time(),
+        memory=read_memory(),
+        load=read_load(),
+        process=read_fields("/proc/self/status", STATUS_FIELDS),
+        uptime=read_uptime(),
+        power_supplies=supplies,
+        battery_status=batteries[0].get("status") if batteries else None,
+    )
+
+
+#########################
+#                      Sampler                               #
+#########################
+class Sampler:
+    # Reads the machine's health every interval on a daemon thread into a ring buffer,
+    # so that a health check only copies what is already there
+    def __init__(self, interval: float = SAMPLE_SECONDS, history: int = HISTORY):
+        self.interval = interval
+        self.samples = deque(maxlen=history)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self.sample()
+            self._thread = threading.Thread(
+                target=self.run, name="health-sampler", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def sample(self):
+        try:
+            self.samples.append(take_sample())
+        except (ValueError, IndexError, OSError):
+            # a file missing or in a format not expected, the next sample may read fine
+            pass
+
+    def run(self):
+        while True:
+            sleep(self.interval)
+            self.sample()
+
+    def age(self) -> Optional[float]:
+        # Seconds since the newest sample was taken
+        latest = self.latest()
+        return None if latest is None else time() - latest["ts"]
+
+    def is_stale(self) -> bool:
+        age = self.age()
+        return age is None or age > STALE_INTERVALS * self.interval
+
+    def latest(self) -> Optional[dict]:
+        return self.samples[-1] if self.samples else None
+
+    def history(self, seconds: Optional[float] = None) -> list:
+        # Samples of the last `seconds`, oldest first; the whole buffer by default
+        samples = list(self.samples)
+        if seconds is None or not samples:
+            return samples
+        return [s for s in samples if s["ts"] >= samples[-1]["ts"] - seconds]
@@ -0,0 +1,109 @@
+import os
+import numpy as np
+import shapely
+from files.artifacts import temp_path
+
+# Point in polygon lookups over the constituency boundaries. The build writes the
+# polygons and their attributes to an .npz file (no pickles, loads with np.load); the
+# STRtree over them is bulk loaded from it once per process, in a few milliseconds.
+
+
+def write_index(path: str, gdf, attributes: list, years: dict):
+    # gdf: one row per region, attributes: its columns served with every match,
+    # years: what the FTTP columns describe ({"fttp": 2023, "fttp_predicted": 2030})
+    wkb = shapely.to_wkb(gdf.geometry.values)
+    offsets = np.cumsum([0] + [len(geometry) for geometry in wkb])
+    arrays = {
+        "wkb": np.frombuffer(b"".join(wkb), dtype=np.uint8),
+        "offsets": offsets.astype(np.int64),
+        "columns": np.array(attributes, dtype=str),
+        "years": np.array([[name, year] for name, year in years.items()], dtype=str),
+    }
+    for column in attributes:
+        values = gdf[column]
+        if values.dtype.kind in "biuf":
+            arrays["column_%s" % column] = values.to_numpy(dtype=float)
+        else:
+            # Fixed width strings, "" where missing: loading them needs no pickle
+            arrays["column_%s" % column] = values.fillna("").to_numpy(dtype=str)
+    tmp = temp_path(path)
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def numbers(values, name: str) -> np.ndarray:
+    if not isinstance(values, list):
+        raise ValueError("%s must be a list" % name)
+    try:
+        array = np.asarray(values)
+    except ValueError:
+        raise ValueError("%s must be a list of numbers" % name)
+    if array.size and array.dtype.kind not in "iuf":
+        raise ValueError("%s must be a list of numbers" % name)
+    return array.astype(float)
+
+
+def parse_points(body: dict) -> tuple:
+    # lat and lon arrays of a lookup request, {"points": [[lat, lon], ...]} or
+    # {"lat": [...], "lon": [...]}; the ValueError of anything else says what is wrong
+    if "points" in body:
+        points = numbers(body["points"], "points")
+        if not len(points):
+            return np.zeros(0), np.zeros(0)
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise ValueError("points must be a list of [lat, lon] pairs")
+        return points[:, 0], points[:, 1]
+    if "lat" not in body or "lon" not in body:
+        raise ValueError('Expected {"points": [[lat, lon], ...]}')
+    lat, lon = numbers(body["lat"], "lat"), numbers(body["lon"], "lon")
+    if lat.ndim != 1 or lon.ndim != 1:
+        raise ValueError("lat and lon must be lists of numbers")
+    if len(lat) != len(lon):
+        raise ValueError("lat and lon must be as long as each other")
+    return lat, lon
+
+
+class PointIndex:
+    def __init__(self, path: str):
+        with np.load(path) as data:
+            wkb, offsets = data["wkb"].tobytes(), data["offsets"]
+            self.geometries = shapely.from_wkb(
+                [wkb[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+            )
+            self.columns = {
+                column: data["column_%s" % column] for column in data["columns"]
+            }
+            self.years = {name: int(year) for name, year in data["years"]}
+        self.tree = shapely.STRtree(self.geometries)
+        # Point in polygon tests against prepared polygons skip rebuilding their edges
+        shapely.prepare(self.geometries)
+
+    def __len__(self) -> int:
+        return len(self.geometries)
+
+    def query(self, lat, lon) -> np.ndarray:
+        # Region index of every point, -1 outside every region. A point on a shared
+        # border gets the first of the regions it touches.
+        points = shapely.points(
+            np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+        )
+        point_index, region_index = self.tree.query(points, predicate="intersects")
+        matches = np.full(len(points), -1)
+        first = np.unique(point_index, return_index=True)[1]
+        matches[point_index[first]] = region_index[first]
+        return matches
+
+    def lookup(self, lat, lon) -> dict:
+        # Columnar, aligned with the points: one list per attribute, null where unmatched
+        matches = self.query(lat, lon)
+        found = matches >= 0
+        result = dict(years=self.years)
+        for column, values in self.columns.items():
+            column_values = values[np.where(found, matches, 0)]
+            if values.dtype.kind == "f":
+                missing = ~found | np.isnan(column_values)
+            else:
+                missing = ~found | (column_values == "")
+            result[column] = np.where(missing, None, column_values).tolist()
+        return result
@@ -0,0 +1,289 @@
+import os
+import json
+import fcntl
+import atexit
+import threading
+from bisect import bisect_left
+from time import monotonic
+from datetime import datetime
+from typing import Optional
+
+# Upper bounds of the histogram buckets, +Inf is added on top of them
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = tuple(4**n for n in range(4, 13))  # 256 B to 16 MB
+# Metric -> (type, help) for the Prometheus text format
+METRICS = {
+    "dashboard_http_requests_total": (
+        "counter",
+        "Requests answered, by route, method and status",
+    ),
+    "dashboard_http_request_duration_seconds": (
+        "histogram",
+        "Time spent answering a request, by route",
+    ),
+    "dashboard_http_response_bytes": (
+        "histogram",
+        "Size of the response bodies sent, by route",
+    ),
+    "dashboard_cache_lookups_total": (
+        "counter",
+        "Cache lookups by cache and where the value was found (memory, disk or miss)",
+    ),
+    "dashboard_loaded_bytes_total": (
+        "counter",
+        "Bytes of parsed data read from the caches under files/data, by source file",
+    ),
+    "dashboard_downloads_total": ("counter", "Ofcom releases downloaded"),
+    "dashboard_last_build_timestamp_seconds": (
+        "gauge",
+        "When the artifacts being served were built",
+    ),
+    "dashboard_last_build_seconds": ("gauge", "Duration of the last build"),
+    "dashboard_last_build_task_seconds": (
+        "gauge",
+        "Duration of each task the last build ran (stages and artifacts)",
+    ),
+    "dashboard_last_build_rss_bytes": (
+        "gauge",
+        "Resident memory of the build process before, after and once released",
+    ),
+    "dashboard_last_build_cache_lookups": (
+        "gauge",
+        "Cache lookups made by the last build, by cache and result",
+    ),
+    "dashboard_last_build_loaded_bytes": (
+        "gauge",
+        "Bytes of parsed data the last build read, by source file",
+    ),
+    "dashboard_last_build_downloads": ("gauge", "Releases the last build downloaded"),
+    "dashboard_artifact_bytes": (
+        "gauge",
+        "Size of the artifacts being served, by artifact and encoding",
+    ),
+}
+
+# Counters of the build process -> gauge they are served as (see build_metrics)
+LAST_BUILD = {
+    "dashboard_cache_lookups_total": "dashboard_last_build_cache_lookups",
+    "dashboard_loaded_bytes_total": "dashboard_last_build_loaded_bytes",
+    "dashboard_downloads_total": "dashboard_last_build_downloads",
+}
+
+
+def label_key(labels: dict) -> str:
+    # Labels in the text format, also used as the key of a series
+    escaped = {
+        name: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for name, value in labels.items()
+    }
+    return ",".join('%s="%s"' % (name, escaped[name]) for name in sorted(escaped))
+
+
+def merge(snapshots: list) -> dict:
+    # Sums the counters and histograms of several processes
+    merged = dict(counters=dict(), histograms=dict())
+    for snapshot in snapshots:
+        for name, series in snapshot.get("counters", {}).items():
+            target = merged["counters"].setdefault(name, dict())
+            for key, value in series.items():
+                target[key] = target.get(key, 0) + value
+        for name, series in snapshot.get("histograms", {}).items():
+            target = merged["histograms"].setdefault(name, dict())
+            for key, histogram in series.items():
+                if key not in target:
+                    target[key] = dict(histogram, counts=list(histogram["counts"]))
+                    continue
+                target[key]["counts"] = [
+                    a + b for a, b in zip(target[key]["counts"], histogram["counts"])
+                ]
+                target[key]["sum"] += histogram["sum"]
+    return merged
+
+
+def sample(name: str, key: str, value) -> str:
+    return "%s{%s} %s" % (name, key, value) if key else "%s %s" % (name, value)
+
+
+def render(snapshot: dict, gauges: list = ()) -> str:
+    # Prometheus text format (version 0.0.4); gauges are (name, labels, value)
+    families = dict()
+    for name, series in snapshot.get("counters", {}).items():
+        families[name] = [sample(name, key, value) for key, value in series.items()]
+    for name, series in snapshot.get("histograms", {}).items():
+        lines = families.setdefault(name, [])
+        for key, histogram in series.items():
+            cumulative = 0
+            bounds = list(histogram["buckets"]) + ["+Inf"]
+            for bound, count in zip(bounds, histogram["counts"]):
+                cumulative += count
+                bucket = ",".join(filter(None, [key, 'le="%s"' % bound]))
+                lines.append(sample("%s_bucket" % name, bucket, cumulative))
+            lines.append(sample("%s_sum" % name, key, histogram["sum"]))
+            lines.append(sample("%s_count" % name, key, cumulative))
+    for name, labels, value in gauges:
+        if value is not None:
+            families.setdefault(name, []).append(sample(name, label_key(labels), value))
+
+    text = []
+    for name in sorted(families):
+        kind, description = METRICS.get(name, ("untyped", name))
+        text.append("# HELP %s %s" % (name, description))
+        text.append("# TYPE %s %s" % (name, kind))
+        text.extend(families[name])
+    return "\n".join(text) + "\n"
+
+
+#########################
+#                   Process metrics                      #
+#########################
+class Metrics:
+    # Counters and histograms of this process, cheap enough to update on every request:
+    # one lock and a couple of dictionary lookups. Under gunicorn each worker writes a
+    # snapshot to <directory>/<pid>.json at most once per flush interval and collect()
+    # adds them up; snapshots of workers that exited are folded into retired.json so
+    # that counters never go backwards when a worker is recycled.
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._flushed = monotonic()
+        self._trailing = None
+        self.reset()
+        atexit.register(self.flush, force=True)
+
+    def reset(self):
+        self.counters = dict()
+        self.histograms = dict()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, dict())
+            series[key] = series.get(key, 0) + value
+
+    def observe(
+        self, name: str, value: float, buckets: tuple = SECONDS_BUCKETS, **labels
+    ):
+        key = label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, dict())
+            if key not in series:
+                series[key] = dict(
+                    buckets=list(buckets), counts=[0] * (len(buckets) + 1), sum=0
+                )
+            series[key]["counts"][bisect_left(buckets, value)] += 1
+            series[key]["sum"] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return json.loads(
+                json.dumps(dict(counters=self.counters, histograms=self.histograms))
+            )
+
+    def take(self) -> dict:
+        # Snapshot and reset, for the metrics of one build task
+        with self._lock:
+            snapshot = dict(counters=self.counters, histograms=self.histograms)
+            self.reset()
+        return snapshot
+
+    def flush(self, force: bool = False, interval: float = 1.0):
+        if self.directory is None:
+            return
+        with self._lock:
+            if not force and monotonic() - self._flushed < interval:
+                # written a moment later, or the end of a burst would never be
+                if self._trailing is None or not self._trailing.is_alive():
+                    self._trailing = threading.Timer(
+                        interval, self.flush, kwargs=dict(force=True)
+                    )
+                    self._trailing.daemon = True
+                    self._trailing.start()
+                return
+            self._flushed = monotonic()
+        # imported here, files.artifacts imports this module
+        from files.artifacts import write_atomic
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "%d.json" % os.getpid())
+        write_atomic(path, json.dumps(self.snapshot()).encode())
+
+    def collect(self) -> dict:
+        # Counters and histograms of every process sharing the directory
+        from files.artifacts import write_atomic
+
+        if self.directory is None:
+            return self.snapshot()
+        self.flush(force=True)
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            retired_path = os.path.join(self.directory, "retired.json")
+            retired, live, exited = self.read(retired_path), [], []
+            for file in os.listdir(self.directory):
+                if not file[:-5].isdigit() or not file.endswith(".json"):
+                    continue
+                path = os.path.join(self.directory, file)
+                (live if process_alive(int(file[:-5])) else exited).append(path)
+            if exited:
+                retired = merge([retired] + [self.read(path) for path in exited])
+                write_atomic(retired_path, json.dumps(retired).encode())
+                for path in exited:
+                    os.remove(path)
+            return merge([retired] + [self.read(path) for path in live])
+
+    def read(self, path: str) -> dict:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return dict()
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def build_metrics(manifest: Optional[dict]) -> tuple:
+    # What the manifest of the artifacts being served says about the build behind
+    # them, as (snapshot, gauges) for render()
+    if manifest is None:
+        return dict(), []
+    report = manifest.get("report", {})
+    gauges = [("dashboard_last_build_seconds", {}, report.get("build_seconds"))]
+    if "built_at" in manifest:
+        built_at = datetime.fromisoformat(manifest["built_at"]).timestamp()
+        gauges.append(("dashboard_last_build_timestamp_seconds", {}, built_at))
+    for task, seconds in report.get("task_seconds", {}).items():
+        gauges.append(("dashboard_last_build_task_seconds", dict(task=task), seconds))
+    for stage, rss in (report.get("rss_bytes") or {}).items():
+        gauges.append(("dashboard_last_build_rss_bytes", dict(stage=stage), rss))
+    sections = (
+        ("maps", ""),
+        ("api", "api/"),
+        ("tiles", "tiles/"),
+        ("lookup", "lookup/"),
+        ("query", "query/"),
+    )
+    for section, prefix in sections:
+        for name, entry in manifest.get(section, {}).items():
+            variants = dict(identity=entry, **entry.get("encodings", {}))
+            for encoding, variant in variants.items():
+                labels = dict(artifact=prefix + name, encoding=encoding)
+                gauges.append(("dashboard_artifact_bytes", labels, variant["bytes"]))
+
+    # The counters of the build process describe that one build: served as gauges
+    counters = report.get("metrics", {}).get("counters", {})
+    snapshot = dict(
+        counters={
+            LAST_BUILD.get(name, name): series for name, series in counters.items()
+        }
+    )
+    return snapshot, gauges
+
+
+metrics = Metrics()
@@ -0,0 +1,333 @@
+import os
+import json
+import string
+import argparse
+from typing import Optional
+import numpy as np
+import pandas as pd
+from files.artifacts import file_sha256, temp_path, write_atomic
+from files.datasets import DATA_DIR, CACHE_DIR
+from files.catalogue import Catalogue
+from files.metrics import metrics
+
+# Ofcom postcode level releases, about 1.7M rows each, are never loaded whole:
+# they are streamed in chunks and folded into per constituency totals on the way.
+# ONS postcode directory (NSPL/ONSPD) or any csv with a postcode and a constituency code
+POSTCODE_LOOKUP = os.getenv(
+    "POSTCODE_LOOKUP", os.path.join(DATA_DIR, "postcode_pcon_lookup.csv")
+)
+CHUNKSIZE = int(os.getenv("POSTCODE_CHUNKSIZE", 250000))
+# Postcodes where less than this share of premises (%) can get full fibre, or can get
+# SPEED_MBIT, count as poorly served
+FTTP_THRESHOLD = float(os.getenv("POSTCODE_FTTP_THRESHOLD", 1.0))
+SPEED_THRESHOLD = float(os.getenv("POSTCODE_SPEED_THRESHOLD", 50.0))
+# Ofcom publishes the share of premises unable to receive 2, 5, 10 and 30Mbit/s
+SPEED_MBIT = int(os.getenv("POSTCODE_SPEED_MBIT", 10))
+SPEED_COLUMN = string.Template("% of premises unable to receive ${mbit}Mbit/s")
+
+# Column names changed between releases: name used here -> names used by Ofcom/ONS
+PC_COLUMNS = {
+    "postcode": ["postcode", "pcds", "postcode_space"],
+    "premises": ["All Premises"],
+    "fttp": [
+        "Full Fibre availability (% premises)",
+        "Estimated Full Fibre availability (% premises)",
+        "FTTP availability (% premises)",
+    ],
+}
+PC_DTYPES = {
+    "postcode": str,
+    "premises": np.int32,
+    "fttp": np.float32,
+    "unable": np.float32,
+}
+LOOKUP_COLUMNS = {"postcode": ["pcds", "pcd", "pcd7", "pcd8"], "pcon": ["pcon"]}
+# Postcode characters -> non zero digits of a base 37 number; spaces and padding are skipped
+POSTCODE_DIGITS = np.zeros(256, dtype=np.int64)
+for digit, char in enumerate("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ", start=1):
+    POSTCODE_DIGITS[ord(char)] = POSTCODE_DIGITS[ord(char.lower())] = digit
+POSTCODE_WIDTH = 10
+
+
+#########################
+#                  Postcode keys                         #
+#########################
+def encode_postcodes(postcodes) -> np.ndarray:
+    # "AB10 1AL", "AB101AL" and "ab10 1al" all become the same int64, which is what both
+    # sides of the join are hashed on instead of 1.7M python strings. Works on the raw
+    # bytes so that no cleaned copy of the strings is ever made.
+    postcodes = pd.Series(postcodes, dtype=object)
+    try:
+        raw = postcodes.fillna("").to_numpy(dtype="S%d" % POSTCODE_WIDTH)
+    except UnicodeEncodeError:
+        # characters outside ASCII ("Å" from a latin read) are skipped like spaces
+        raw = (
+            postcodes.str.encode("ascii", errors="ignore")
+            .fillna(b"")
+            .to_numpy(dtype="S%d" % POSTCODE_WIDTH)
+        )
+    chars = raw.view(np.uint8).reshape(len(raw), POSTCODE_WIDTH)
+    keys = np.zeros(len(raw), dtype=np.int64)
+    for position in range(POSTCODE_WIDTH):
+        digits = POSTCODE_DIGITS[chars[:, position]]
+        keys = np.where(digits > 0, keys * 37 + digits, keys)
+    return keys
+
+
+def find_columns(header: list, aliases: dict) -> dict:
+    # Ofcom/ONS column name -> name used here, for the first alias present in the file
+    found = dict()
+    for name, candidates in aliases.items():
+        for candidate in candidates:
+            if candidate in header:
+                found[candidate] = name
+                break
+        else:
+            raise ValueError("None of %s in %s" % (candidates, header))
+    return found
+
+
+def read_chunks(path: str, aliases: dict, dtypes: dict, chunksize: int = CHUNKSIZE):
+    header = list(pd.read_csv(path, nrows=0, encoding="latin").columns)
+    columns = find_columns(header, aliases)
+    for chunk in pd.read_csv(
+        path,
+        usecols=list(columns),
+        dtype={column: dtypes.get(name, str) for column, name in columns.items()},
+        chunksize=chunksize,
+        encoding="latin",
+    ):
+        yield chunk.rename(columns=columns)
+
+
+#########################
+#          Postcode -> constituency lookup          #
+#########################
+class PostcodeLookup:
+    # Postcode keys and the constituency each one belongs to. Built once from the
+    # lookup csv into cache/pcon-lookup-<sha256>.parquet (int64 key, dictionary
+    # encoded code) and joined against through a hash index.
+    def __init__(self, path: str = POSTCODE_LOOKUP, cache_dir: str = CACHE_DIR):
+        if not os.path.exists(path):
+            raise FileNotFoundError("Postcode lookup %s not found" % path)
+        self.path = path
+        self.sha256 = file_sha256(path)
+        parquet = os.path.join(cache_dir, "pcon-lookup-%s.parquet" % self.sha256)
+        if not os.path.exists(parquet):
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = temp_path(parquet)
+            self.build(path).to_parquet(tmp, index=False)
+            os.replace(tmp, parquet)
+        lookup = pd.read_parquet(parquet)
+        self.constituencies = np.asarray(lookup["pcon"].cat.categories, dtype=object)
+        self.codes = lookup["pcon"].cat.codes.to_numpy()
+        self.index = pd.Index(lookup["key"].to_numpy())
+
+    def build(self, path: str) -> pd.core.frame.DataFrame:
+        chunks = []
+        for chunk in read_chunks(path, LOOKUP_COLUMNS, dict()):
+            chunk = chunk.dropna(subset=["pcon"])
+            chunks.append(
+                pd.DataFrame(
+                    {
+                        "key": encode_postcodes(chunk["postcode"]),
+                        "pcon": chunk["pcon"].astype("category"),
+                    }
+                )
+            )
+        lookup = pd.concat(chunks, ignore_index=True)
+        lookup["pcon"] = lookup["pcon"].astype(str).astype("category")
+        return lookup.drop_duplicates("key")
+
+    def constituency_codes(self, postcodes) -> np.ndarray:
+        # Position of each postcode's constituency in self.constituencies, -1 if unknown
+        positions = self.index.get_indexer(encode_postcodes(postcodes))
+        return np.where(positions >= 0, self.codes[positions], -1)
+
+
+#########################
+#        Streaming aggregation                       #
+#########################
+def default_thresholds() -> dict:
+    return {"fttp": FTTP_THRESHOLD, "speed": SPEED_THRESHOLD}
+
+
+def aggregate_postcodes(
+    path: str,
+    lookup: PostcodeLookup,
+    thresholds: Optional[dict] = None,
+    speed_mbit: int = SPEED_MBIT,
+    chunksize: int = CHUNKSIZE,
+) -> tuple:
+    # One pass over the postcode file, holding a single chunk at a time.
+    # thresholds: "fttp" and/or "speed" -> coverage (% premises) a postcode needs to not
+    # count as below it. Returns (per constituency frame, report)
+    thresholds = default_thresholds() if thresholds is None else thresholds
+    aliases = dict(PC_COLUMNS)
+    if "speed" in thresholds:
+        aliases["unable"] = [SPEED_COLUMN.substitute(mbit=speed_mbit)]
+    size = len(lookup.constituencies) + 1  # last slot collects unmatched postcodes
+    counts = ["postcodes", "premises"]
+    for measure in thresholds:
+        counts += ["%s_postcodes_below" % measure, "%s_premises_below" % measure]
+    totals = {name: np.zeros(size) for name in counts + ["fttp_premises"]}
+
+    rows = 0
+    for chunk in read_chunks(path, aliases, PC_DTYPES, chunksize):
+        rows += len(chunk)
+        codes = lookup.constituency_codes(chunk["postcode"])
+        codes[codes < 0] = size - 1
+        premises = chunk["premises"].to_numpy(dtype=np.float64)
+        fttp = chunk["fttp"].to_numpy(dtype=np.float64)
+        coverage = {"fttp": fttp}
+        if "speed" in thresholds:
+            coverage["speed"] = 100 - chunk["unable"].to_numpy(dtype=np.float64)
+        weights = {
+            "postcodes": None,
+            "premises": premises,
+            "fttp_premises": premises * np.nan_to_num(fttp) / 100,
+        }
+        for measure, threshold in thresholds.items():
+            below = (coverage[measure] < threshold).astype(np.float64)
+            weights["%s_postcodes_below" % measure] = below
+            weights["%s_premises_below" % measure] = premises * below
+        for name, weight in weights.items():
+            totals[name] += np.bincount(codes, weights=weight, minlength=size)
+
+    df = pd.DataFrame({name: total[:-1] for name, total in totals.items()})
+    df.insert(0, "pcon", lookup.constituencies)
+    df[counts] = df[counts].astype(np.int64)
+    df = df[df["postcodes"] > 0].reset_index(drop=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["fttp_share"] = df["fttp_premises"] / df["premises"] * 100
+        for measure in thresholds:
+            for unit in ["postcodes", "premises"]:
+                df["%s_%s_share_below" % (measure, unit)] = (
+                    df["%s_%s_below" % (measure, unit)] / df[unit] * 100
+                )
+    report = dict(
+        source=os.path.basename(path),
+        rows=rows,
+        unmatched_postcodes=int(totals["postcodes"][-1]),
+        constituencies=len(df),
+        thresholds=thresholds,
+        speed_mbit=speed_mbit,
+    )
+    return df, report
+
+
+class PostcodeCoverage:
+    # Per constituency aggregates of each year's postcode release, written to
+    # cache/pc-coverage-<source sha256>-<lookup sha256>-<thresholds>.parquet so that
+    # a release is only streamed again when it, the lookup or a threshold changes, and
+    # a new release only costs one pass over that release.
+    def __init__(
+        self,
+        data_dir: str = DATA_DIR,
+        cache_dir: str = CACHE_DIR,
+        lookup_path: str = POSTCODE_LOOKUP,
+        thresholds: Optional[dict] = None,
+        speed_mbit: int = SPEED_MBIT,
+    ):
+        self.data_dir = data_dir
+        self.catalogue = Catalogue(data_dir)
+        self.cache_dir = cache_dir
+        self.lookup_path = lookup_path
+        self.thresholds = default_thresholds() if thresholds is None else thresholds
+        self.speed_mbit = speed_mbit
+        self._lookup = None
+        self._lookup_sha256 = None
+
+    @property
+    def lookup(self) -> PostcodeLookup:
+        if self._lookup is None:
+            self._lookup = PostcodeLookup(self.lookup_path, self.cache_dir)
+        return self._lookup
+
+    def lookup_sha256(self) -> str:
+        # the postcode directory is large, hash it once rather than once per year
+        if self._lookup_sha256 is None:
+            self._lookup_sha256 = file_sha256(self.lookup_path)
+        return self._lookup_sha256
+
+    def source(self, year: int) -> Optional[str]:
+        filename = self.catalogue.postcode_filename(year)
+        if filename is None:
+            return None
+        return os.path.join(self.data_dir, filename)
+
+    def cache_path(self, path: str) -> str:
+        settings = "-".join(
+            "%s%s" % (measure, threshold)
+            for measure, threshold in sorted(self.thresholds.items())
+        )
+        if "speed" in self.thresholds:
+            settings += "-%smbit" % self.speed_mbit
+        name = "pc-coverage-%s-%s-%s" % (file_sha256(path), self.lookup_sha256(), settings)
+        return os.path.join(self.cache_dir, "%s.parquet" % name)
+
+    def load_year(self, year: int) -> Optional[pd.core.frame.DataFrame]:
+        # None when the release for that year is not under files/data
+        path = self.source(year)
+        if path is None:
+            return None
+        parquet = self.cache_path(path)
+        result = "disk" if os.path.exists(parquet) else "miss"
+        metrics.inc("dashboard_cache_lookups_total", cache="postcodes", result=result)
+        if result == "miss":
+            df, report = aggregate_postcodes(
+                path, self.lookup, self.thresholds, self.speed_mbit
+            )
+            df.insert(0, "year", year)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = temp_path(parquet)
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, parquet)
+            write_atomic(
+                parquet.replace(".parquet", ".json"),
+                json.dumps(dict(report, year=year), indent=2).encode(),
+            )
+        metrics.inc(
+            "dashboard_loaded_bytes_total",
+            os.path.getsize(parquet),
+            source=os.path.basename(path),
+        )
+        return pd.read_parquet(parquet)
+
+    def load_years(self, years) -> pd.core.frame.DataFrame:
+        # Every year with a release under files/data, one row per constituency and year
+        frames = [self.load_year(year) for year in years]
+        frames = [df for df in frames if df is not None]
+        if not frames:
+            return pd.DataFrame(columns=["year", "pcon"])
+        return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Aggregate Ofcom postcode coverage to constituencies"
+    )
+    parser.add_argument("years", type=int, nargs="*", default=Catalogue().postcode_years())
+    parser.add_argument("--fttp-threshold", type=float, default=FTTP_THRESHOLD)
+    parser.add_argument("--speed-threshold", type=float, default=SPEED_THRESHOLD)
+    parser.add_argument("--speed-mbit", type=int, default=SPEED_MBIT)
+    args = parser.parse_args()
+
+    coverage = PostcodeCoverage(
+        thresholds={"fttp": args.fttp_threshold, "speed": args.speed_threshold},
+        speed_mbit=args.speed_mbit,
+    )
+    for year in args.years:
+        df = coverage.load_year(year)
+        if df is None:
+            print("%s: no postcode release under %s" % (year, coverage.data_dir))
+        else:
+            print(
+                "%s: %d constituencies, %d postcodes, %.1f%% of premises with FTTP"
+                % (
+                    year,
+                    len(df),
+                    df["postcodes"].sum(),
+                    df["fttp_premises"].sum() / df["premises"].sum() * 100,
+                )
+            )
@@ -0,0 +1,302 @@
+import os
+import json
+import math
+import numpy as np
+import pandas as pd
+from files.artifacts import temp_path
+
+# Ad hoc queries over the tables the build writes next to the maps. A query is
+# {"table", "filter", "group_by", "aggregate", "columns", "sort", "limit"}, e.g. the
+# growth of full fibre in rural constituencies:
+#   {"table": "uk_fttp",
+#    "filter": [["ruc", "==", "Sparse and rural"], ["year", "between", [2019, 2023]]],
+#    "group_by": ["code", "name"], "aggregate": {"growth": ["fttp", "change"]},
+#    "sort": ["-growth"], "limit": 20}
+# Filters, grouping, aggregates and top-k all run on whole columns.
+OPERATORS = ("==", "!=", "<", "<=", ">", ">=", "in", "not in", "between")
+# first, last and change (last - first) follow the order of the table: by year
+AGGREGATES = ("count", "sum", "mean", "min", "max", "median", "first", "last", "change")
+MAX_LIMIT = 100000
+
+
+class QueryError(ValueError):
+    pass
+
+
+def write_tables(path: str, tables: dict):
+    # table -> DataFrame, stored column by column in an .npz (no pickles). Strings are
+    # interned: each distinct one once, and a code per row.
+    arrays = {"tables": np.array(list(tables), dtype=str)}
+    for table, frame in tables.items():
+        arrays["columns/%s" % table] = np.array(list(frame.columns), dtype=str)
+        for column in frame.columns:
+            values = frame[column]
+            name = "%s/%s" % (table, column)
+            if values.dtype.kind in "biuf":
+                arrays[name] = values.to_numpy()
+            else:
+                codes, labels = pd.factorize(values.fillna("").astype(str))
+                arrays[name] = codes.astype(np.int32)
+                arrays["%s/labels" % name] = np.asarray(labels, dtype=str)
+    tmp = temp_path(path)
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def finite(value) -> bool:
+    # JSON has no infinity or NaN to echo a filter value like 1e400 back with
+    if isinstance(value, list):
+        return all(finite(item) for item in value)
+    return not isinstance(value, float) or math.isfinite(value)
+
+
+def normalize(query) -> dict:
+    # The canonical form of a query, which the result cache is keyed by: defaults
+    # filled in, filters in a fixed order (they all apply), a single column name given
+    # for group_by, columns or sort as a list of one
+    if not isinstance(query, dict) or not isinstance(query.get("table"), str):
+        raise QueryError('A query is a JSON object with at least a "table"')
+    unknown = set(query) - {
+        "table",
+        "filter",
+        "group_by",
+        "aggregate",
+        "columns",
+        "sort",
+        "limit",
+    }
+    if unknown:
+        raise QueryError("Unknown query fields: %s" % ", ".join(sorted(unknown)))
+    filters = query.get("filter") or []
+    if not isinstance(filters, list) or not all(
+        isinstance(f, list)
+        and len(f) == 3
+        and isinstance(f[0], str)
+        and isinstance(f[1], str)
+        and f[1] in OPERATORS
+        for f in filters
+    ):
+        raise QueryError(
+            "filter is a list of [column, operator, value], operators: %s"
+            % ", ".join(OPERATORS)
+        )
+    if not all(finite(f[2]) for f in filters):
+        raise QueryError("filter values must be finite numbers")
+    aggregate = query.get("aggregate") or {}
+    if not isinstance(aggregate, dict) or not all(
+        isinstance(spec, list)
+        and len(spec) == 2
+        and isinstance(spec[0], str)
+        and spec[1] in AGGREGATES
+        for spec in aggregate.values()
+    ):
+        raise QueryError(
+            "aggregate maps an output column to [column, function], functions: %s"
+            % ", ".join(AGGREGATES)
+        )
+    listed = dict()
+    for field in ("group_by", "columns", "sort"):
+        value = query.get(field) or []
+        listed[field] = [value] if isinstance(value, str) else value
+        if not isinstance(listed[field], list) or not all(
+            isinstance(column, str) for column in listed[field]
+        ):
+            raise QueryError("%s is a column name or a list of them" % field)
+    clashes = sorted(set(aggregate) & set(listed["group_by"]))
+    if clashes:
+        raise QueryError(
+            "aggregate outputs can't be named after group_by columns: %s"
+            % ", ".join(clashes)
+        )
+    limit = query.get("limit")
+    if limit is not None and (
+        not isinstance(limit, int) or isinstance(limit, bool) or limit < 1
+    ):
+        raise QueryError("limit is a positive number of rows")
+    return dict(
+        table=query["table"],
+        filter=sorted(filters, key=lambda f: json.dumps(f, sort_keys=True)),
+        group_by=listed["group_by"],
+        aggregate={name: list(spec) for name, spec in sorted(aggregate.items())},
+        columns=listed["columns"],
+        sort=listed["sort"],
+        limit=min(limit, MAX_LIMIT) if limit is not None else MAX_LIMIT,
+    )
+
+
+def key(query: dict) -> str:
+    return json.dumps(query, sort_keys=True, separators=(",", ":"))
+
+
+class QueryEngine:
+    def __init__(self, path: str):
+        self.tables = dict()
+        with np.load(path) as data:
+            for table in data["tables"]:
+                self.tables[table] = dict()
+                for column in data["columns/%s" % table]:
+                    name = "%s/%s" % (table, column)
+                    values = data[name]
+                    if "%s/labels" % name in data:
+                        values = data["%s/labels" % name][values]
+                    self.tables[table][column] = values
+
+    def schema(self) -> dict:
+        # table -> {column: type}, what a query can use
+        return {
+            table: {
+                column: "number" if values.dtype.kind in "biuf" else "string"
+                for column, values in columns.items()
+            }
+            for table, columns in self.tables.items()
+        }
+
+    def column(self, table: dict, name: str) -> np.ndarray:
+        if name not in table:
+            raise QueryError("Unknown column %s" % name)
+        return table[name]
+
+    def mask(self, table: dict, filters: list) -> np.ndarray:
+        rows = len(next(iter(table.values())))
+        mask = np.ones(rows, dtype=bool)
+        for name, operator, value in filters:
+            values = self.column(table, name)
+            try:
+                if operator == "between":
+                    low, high = value
+                    mask &= (values >= low) & (values <= high)
+                elif operator in ("in", "not in"):
+                    if not isinstance(value, list):
+                        raise TypeError(value)
+                    found = pd.Index(values).isin(value)
+                    mask &= found if operator == "in" else ~found
+                else:
+                    mask &= {
+                        "==": np.equal,
+                        "!=": np.not_equal,
+                        "<": np.less,
+                        "<=": np.less_equal,
+                        ">": np.greater,
+                        ">=": np.greater_equal,
+                    }[operator](values, value)
+            except (TypeError, ValueError):
+                raise QueryError("Cannot compare %s %s %r" % (name, operator, value))
+        return mask
+
+    def group(self, table: dict, mask: np.ndarray, group_by: list, aggregate: dict):
+        # Group ids over the filtered rows, in order of the first row of each group.
+        # A query aggregating without group_by has one group, even without rows.
+        keys = [self.column(table, name)[mask] for name in group_by]
+        ids = np.zeros(int(mask.sum()), dtype=int)
+        if keys and len(ids):
+            codes = [pd.factorize(values)[0] for values in keys]
+            combined = np.ravel_multi_index(codes, [c.max() + 1 for c in codes])
+            ids = pd.factorize(combined)[0]
+        groups = 1
+        if keys:
+            groups = int(ids.max()) + 1 if len(ids) else 0
+        # Rows of each group together, the table order kept inside a group
+        order = np.argsort(ids, kind="stable")
+        counts = np.bincount(ids, minlength=groups)
+        starts = np.cumsum(counts) - counts
+
+        result = {name: values[order[starts]] for name, values in zip(group_by, keys)}
+        for output, (name, function) in aggregate.items():
+            result[output] = self.aggregate(
+                self.column(table, name)[mask], function, ids, order, counts, starts
+            )
+        return result
+
+    def aggregate(self, values, function, ids, order, counts, starts) -> np.ndarray:
+        groups = len(counts)
+        if function == "count":
+            return counts
+        if function in ("first", "last") or values.dtype.kind not in "biuf":
+            if function not in ("first", "last"):
+                raise QueryError("%s needs a numeric column" % function)
+            if not len(values):
+                return np.full(groups, "" if values.dtype.kind == "U" else np.nan)
+            return values[order[starts if function == "first" else starts + counts - 1]]
+        values = values.astype(float)
+        present = ~np.isnan(values)
+        if function in ("sum", "mean"):
+            weights = np.where(present, values, 0)
+            sums = np.bincount(ids, weights=weights, minlength=groups)
+            if function == "sum":
+                return sums
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return sums / np.bincount(ids, weights=present, minlength=groups)
+        if not len(values):
+            # the one group of a query without group_by, over no rows
+            return np.full(groups, np.nan)
+        if function == "change":
+            return values[order[starts + counts - 1]] - values[order[starts]]
+        if function in ("min", "max"):
+            reduce = np.fmin if function == "min" else np.fmax
+            return reduce.reduceat(values[order], starts)
+        # median: values sorted inside each group, missing ones last
+        by_value = np.lexsort((values, ids))
+        sorted_values = values[by_value]
+        valid = np.bincount(ids, weights=present, minlength=groups).astype(int)
+        low = starts + np.maximum(valid - 1, 0) // 2
+        high = starts + valid // 2
+        return (sorted_values[low] + sorted_values[high]) / 2
+
+    def top(self, result: dict, sort: list, limit: int) -> np.ndarray:
+        # Row order: the sort keys ("-column" descending), the first `limit` rows only
+        rows = len(next(iter(result.values()))) if result else 0
+        if not sort:
+            return np.arange(min(rows, limit))
+        keys = []
+        for name in reversed(sort):
+            descending = name.startswith("-")
+            name = name[1:] if descending else name
+            if name not in result:
+                raise QueryError("Cannot sort by %s, it is not in the result" % name)
+            values = result[name]
+            if values.dtype.kind in "biuf":
+                values = values.astype(float)
+                # missing values last whichever the direction
+                values = np.where(
+                    np.isnan(values), np.inf, -values if descending else values
+                )
+            elif descending:
+                values = -pd.factorize(values, sort=True)[0]
+            keys.append(values)
+        if len(keys) == 1 and limit < rows:
+            # top-k: only the rows that can make it are sorted, every row tied with the
+            # last one included so that ties go by row order as in a full sort
+            kth = np.partition(keys[0], limit - 1)[limit - 1]
+            candidates = np.flatnonzero(keys[0] <= kth)
+            order = np.argsort(keys[0][candidates], kind="stable")
+            return candidates[order][:limit]
+        # lexsort is stable: rows with equal keys stay in row order
+        return np.lexsort(keys)[:limit]
+
+    def run(self, query: dict) -> dict:
+        # query: as normalized by normalize()
+        if query["table"] not in self.tables:
+            raise QueryError(
+                "Unknown table %s, tables: %s"
+                % (query["table"], ", ".join(self.tables))
+            )
+        table = self.tables[query["table"]]
+        mask = self.mask(table, query["filter"])
+        if query["group_by"] or query["aggregate"]:
+            result = self.group(table, mask, query["group_by"], query["aggregate"])
+        else:
+            columns = query["columns"] or list(table)
+            result = {name: self.column(table, name)[mask] for name in columns}
+        order = self.top(result, query["sort"], query["limit"])
+        if query["columns"] and (query["group_by"] or query["aggregate"]):
+            result = {name: result[name] for name in query["columns"] if name in result}
+        columns = dict()
+        for name, values in result.items():
+            values = values[order]
+            if values.dtype.kind == "f":
+                values = np.where(np.isnan(values), None, np.round(values, 4))
+            elif values.dtype.kind == "U":
+                values = np.where(values == "", None, values)
+            columns[name] = values.tolist()
+        return dict(rows=len(order), columns=columns)
@@ -0,0 +1,78 @@
+import os
+from time import perf_counter
+from typing import Callable, Optional
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+def default_workers() -> int:
+    # CPUs this process may run on, fewer than the machine's under taskset or a cpuset
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    return int(os.getenv("BUILD_WORKERS", cpus))
+
+
+def topological_order(tasks: dict) -> list:
+    # tasks: name -> names of the tasks it depends on
+    order, visiting, visited = [], set(), set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError("Dependency cycle through %s" % name)
+        if name not in tasks:
+            raise KeyError("Unknown build task %s" % name)
+        visiting.add(name)
+        for dependency in tasks[name]:
+            visit(dependency)
+        visiting.discard(name)
+        visited.add(name)
+        order.append(name)
+
+    for name in tasks:
+        visit(name)
+    return order
+
+
+def run(
+    tasks: dict,
+    function: Callable,
+    workers: Optional[int] = None,
+    initializer: Optional[Callable] = None,
+    initargs: tuple = (),
+) -> tuple:
+    # Runs function(name, {dependency: result}) for every task once its dependencies are done.
+    # Independent tasks run in a process pool, or one after another when only one core is
+    # available. Returns ({name: result}, {name: seconds}).
+    order = topological_order(tasks)
+    workers = default_workers() if workers is None else workers
+    results, seconds = dict(), dict()
+
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for name in order:
+            start = perf_counter()
+            results[name] = function(name, {dep: results[dep] for dep in tasks[name]})
+            seconds[name] = round(perf_counter() - start, 3)
+        return results, seconds
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=initializer, initargs=initargs
+    ) as pool:
+        waiting, running = list(order), dict()
+        while waiting or running:
+            for name in list(waiting):
+                if all(dep in results for dep in tasks[name]):
+                    waiting.remove(name)
+                    inputs = {dep: results[dep] for dep in tasks[name]}
+                    future = pool.submit(function, name, inputs)
+                    running[future] = (name, perf_counter())
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, start = running.pop(future)
+                results[name] = future.result()
+                seconds[name] = round(perf_counter() - start, 3)
+    return results, seconds
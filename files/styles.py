@@ -0,0 +1,62 @@
+from datetime import datetime
+import numpy as np
+from branca.colormap import LinearColormap
+
+# Regions with no value are drawn fully transparent instead of failing the colormap lookup
+NAN_COLOR = "#00000000"
+
+
+def year_timestamps(years) -> np.ndarray:
+    # datetime(year, 1, 1).timestamp() depends on the local timezone, so keep using it,
+    # but only once per distinct year rather than once per row
+    unique, inverse = np.unique(np.asarray(years, dtype=int), return_inverse=True)
+    stamps = np.array(
+        [int(datetime(int(year), 1, 1).timestamp()) for year in unique], dtype=np.int64
+    )
+    return stamps[inverse]
+
+
+def map_colors(values, cmap: LinearColormap) -> np.ndarray:
+    # Vectorised equivalent of calling cmap(value) on every value:
+    # interpolate between the colormap stops, pack the RGBA bytes into one integer and
+    # format each distinct colour once through a lookup table.
+    values = np.asarray(values, dtype=float)
+    index = np.asarray(cmap.index, dtype=float)
+    colors = np.asarray(cmap.colors, dtype=float)
+
+    upper = np.clip(np.searchsorted(index, values, side="left"), 1, len(index) - 1)
+    lower = upper - 1
+    width = index[upper] - index[lower]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = np.where(width > 0, (values - index[lower]) * 1.0 / width, 1.0)
+    rgba = (1.0 - p)[:, None] * colors[lower] + p[:, None] * colors[upper]
+    rgba[values <= index[0]] = colors[0]
+    rgba[values >= index[-1]] = colors[-1]
+
+    rgba_bytes = (rgba * 255.9999).astype(np.uint32)
+    packed = (
+        (rgba_bytes[:, 0] << 24)
+        | (rgba_bytes[:, 1] << 16)
+        | (rgba_bytes[:, 2] << 8)
+        | rgba_bytes[:, 3]
+    )
+    unique, inverse = np.unique(packed, return_inverse=True)
+    lookup = np.array(["#%08x" % color for color in unique.tolist()] + [NAN_COLOR])
+    inverse[np.isnan(values)] = len(unique)
+    return lookup[inverse]
+
+
+def make_styledict(regions, years, values, cmap: LinearColormap, opacity=0.5) -> dict:
+    # {region: {timestamp: {"opacity", "color"}}} as expected by TimeSliderChoropleth,
+    # regions in order of first appearance, in a single pass over the rows
+    stamps = year_timestamps(years)
+    colors = map_colors(values, cmap)
+    styledict = dict()
+    for region, stamp, color in zip(
+        np.asarray(regions).tolist(), stamps.tolist(), colors.tolist()
+    ):
+        styledict.setdefault(region, dict())[stamp] = {
+            "opacity": opacity,
+            "color": color,
+        }
+    return styledict
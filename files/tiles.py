@@ -0,0 +1,174 @@
+import os
+import json
+import gzip
+import sqlite3
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+import mapbox_vector_tile
+from files.artifacts import temp_path
+
+# Web Mercator: the world is a square 2 * HALF_WORLD metres wide, 2**z tiles a side
+HALF_WORLD = 20037508.342789244
+MAX_LATITUDE = 85.0511287798
+# Tile coordinates are integers between 0 and EXTENT, features run BUFFER units past
+# every edge so that outlines don't show a seam where two tiles meet
+EXTENT = 4096
+BUFFER = 64
+
+
+def tile_size(zoom: int) -> float:
+    return 2 * HALF_WORLD / 2**zoom
+
+
+def tile_bounds(zoom: int, x, y) -> tuple:
+    # Mercator (minx, miny, maxx, maxy) of XYZ tiles, y counting down from the north
+    size = tile_size(zoom)
+    x, y = np.asarray(x), np.asarray(y)
+    return (
+        -HALF_WORLD + x * size,
+        HALF_WORLD - (y + 1) * size,
+        -HALF_WORLD + (x + 1) * size,
+        HALF_WORLD - y * size,
+    )
+
+
+def covering_tiles(bounds: tuple, zoom: int) -> tuple:
+    # x and y of every tile that the mercator bounds touch
+    size, last = tile_size(zoom), 2**zoom - 1
+    minx, miny, maxx, maxy = bounds
+    xs = np.arange(
+        max(0, int((minx + HALF_WORLD) // size)),
+        min(last, int((maxx + HALF_WORLD) // size)) + 1,
+    )
+    ys = np.arange(
+        max(0, int((HALF_WORLD - maxy) // size)),
+        min(last, int((HALF_WORLD - miny) // size)) + 1,
+    )
+    x, y = np.meshgrid(xs, ys)
+    return x.ravel(), y.ravel()
+
+
+def simplify(geometries: np.ndarray, tolerance: float) -> np.ndarray:
+    # Shared borders simplified once for both sides as in files.geometry, unless the
+    # polygons are no coverage: coverage_simplify fails when a feature vanishes
+    if hasattr(shapely, "coverage_simplify"):
+        try:
+            return shapely.coverage_simplify(geometries, tolerance)
+        except ValueError:
+            pass
+    return shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+
+def tile_properties(gdf: gpd.geodataframe.GeoDataFrame) -> list:
+    # Feature attributes without the missing values, which MVT has no encoding for
+    properties = []
+    for record in gdf.drop(columns="geometry").to_dict("records"):
+        properties.append(
+            {
+                key: value.item() if isinstance(value, np.generic) else value
+                for key, value in record.items()
+                if not pd.isna(value)
+            }
+        )
+    return properties
+
+
+def make_tiles(
+    name: str, gdf: gpd.geodataframe.GeoDataFrame, minzoom: int, maxzoom: int
+) -> dict:
+    # (z, x, y) -> gzipped MVT of every tile with a feature of the layer in it
+    # Mercator has no room for the poles
+    world = (-180, -MAX_LATITUDE, 180, MAX_LATITUDE)
+    projected = gdf.set_geometry(shapely.clip_by_rect(gdf.geometry.values, *world))
+    projected = projected[~projected.geometry.is_empty].to_crs("EPSG:3857")
+    geometries = projected.geometry.values
+    properties = tile_properties(projected)
+
+    tiles = dict()
+    for zoom in range(minzoom, maxzoom + 1):
+        # Drop the detail a tile can't draw: one tile unit at this zoom
+        tolerance = tile_size(zoom) / EXTENT
+        simplified = simplify(geometries, tolerance)
+        x, y = covering_tiles(shapely.total_bounds(simplified), zoom)
+        margin = tile_size(zoom) * BUFFER / EXTENT
+        minx, miny, maxx, maxy = tile_bounds(zoom, x, y)
+        boxes = shapely.box(minx - margin, miny - margin, maxx + margin, maxy + margin)
+        # Every (tile, feature) pair that intersects in one query
+        tile_index, feature_index = shapely.STRtree(simplified).query(
+            boxes, predicate="intersects"
+        )
+        for tile in np.unique(tile_index):
+            features = feature_index[tile_index == tile]
+            clipped = shapely.clip_by_rect(
+                simplified[features], *shapely.bounds(boxes[tile])
+            )
+            layer = dict(
+                name=name,
+                features=[
+                    dict(geometry=geometry, properties=properties[i], id=int(i))
+                    for i, geometry in zip(features, clipped)
+                    if not geometry.is_empty
+                ],
+            )
+            if not layer["features"]:
+                continue
+            data = mapbox_vector_tile.encode(
+                [layer],
+                default_options=dict(
+                    quantize_bounds=(minx[tile], miny[tile], maxx[tile], maxy[tile]),
+                    extents=EXTENT,
+                ),
+            )
+            tiles[(zoom, int(x[tile]), int(y[tile]))] = gzip.compress(data, mtime=0)
+    return tiles
+
+
+def tile_metadata(
+    name: str, gdf: gpd.geodataframe.GeoDataFrame, minzoom: int, maxzoom: int
+) -> dict:
+    # MBTiles metadata table, "json" describes the attributes for style editors
+    minx, miny, maxx, maxy = gdf.total_bounds
+    miny, maxy = max(miny, -MAX_LATITUDE), min(maxy, MAX_LATITUDE)
+    fields = {
+        column: "Number" if pd.api.types.is_numeric_dtype(gdf[column]) else "String"
+        for column in gdf.columns
+        if column != "geometry"
+    }
+    vector_layers = [dict(id=name, fields=fields, minzoom=minzoom, maxzoom=maxzoom)]
+    return dict(
+        name=name,
+        format="pbf",
+        type="overlay",
+        minzoom=str(minzoom),
+        maxzoom=str(maxzoom),
+        bounds="%f,%f,%f,%f" % (minx, miny, maxx, maxy),
+        center="%f,%f,%d" % ((minx + maxx) / 2, (miny + maxy) / 2, minzoom),
+        json=json.dumps(dict(vector_layers=vector_layers)),
+    )
+
+
+def write_mbtiles(path: str, metadata: dict, tiles: dict):
+    # MBTiles 1.3: rows are counted from the south (TMS), the reverse of XYZ URLs
+    tmp = temp_path(path)
+    db = sqlite3.connect(tmp)
+    try:
+        db.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        db.execute(
+            "CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, "
+            "tile_row INTEGER, tile_data BLOB)"
+        )
+        db.execute(
+            "CREATE UNIQUE INDEX tile_index "
+            "ON tiles (zoom_level, tile_column, tile_row)"
+        )
+        db.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+        db.executemany(
+            "INSERT INTO tiles VALUES (?, ?, ?, ?)",
+            [(z, x, 2**z - 1 - y, data) for (z, x, y), data in sorted(tiles.items())],
+        )
+        db.commit()
+    finally:
+        db.close()
+    os.replace(tmp, path)
@@ -0,0 +1,38 @@
+import gc
+import os
+import multiprocessing
+
+# Production server for the dashboard: `gunicorn -c gunicorn.conf.py`
+# (`python app.py` stays the development server)
+wsgi_app = "app:application"
+bind = os.getenv("BIND", "0.0.0.0:80")
+
+# One process per core, each with a few threads for requests waiting on the network
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+# app.py is imported once in the master, which builds the artifacts when files/data
+# changed and loads them; the workers are forked with the artifacts already in memory
+# and share those pages copy-on-write instead of each loading its own copy
+preload_app = True
+
+# Workers are replaced after max_requests (+ jitter so they don't all restart at once),
+# finishing the requests they are serving within graceful_timeout
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 1000))
+graceful_timeout = 30
+# /admin/reload rebuilds in a background thread, requests themselves are short
+timeout = 60
+keepalive = 5
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+
+
+def when_ready(server):
+    # Move everything loaded by app.py out of the collected generations: the garbage
+    # collector would otherwise write to every object header in the workers and copy
+    # the shared pages one by one
+    gc.collect()
+    gc.freeze()
+
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+from string import Template
+from files.backend import Backend
+
+ROW_TEMPLATE = Template("FTTP$year")
+YEARS = range(2019, 2024)
+
+
+def make_frame() -> pd.core.frame.DataFrame:
+    rng = np.random.default_rng(0)
+    values = rng.uniform(0, 100, size=(6, len(YEARS)))
+    values[1] = np.nan
+    values[2, 3] = np.nan
+    df = pd.DataFrame(values, columns=["FTTP%s" % year for year in YEARS])
+    df["URClass"] = ["Urban", "Urban", "Rural", "Rural", "Urban", "Rural"]
+    return df
+
+
+def fn_calc(batched: bool, urclass=None) -> pd.core.frame.DataFrame:
+    # fn_calc only fits rows, the datasets Backend() would load aren't needed
+    backend = Backend.__new__(Backend)
+    return backend.fn_calc(make_frame(), urclass, ROW_TEMPLATE, batched=batched)
+
+
+def test_batched_fit_matches_row_by_row():
+    batched, row_by_row = fn_calc(batched=True), fn_calc(batched=False)
+    assert list(batched.columns) == list(row_by_row.columns)
+    np.testing.assert_allclose(
+        batched.drop(columns="URClass").to_numpy(dtype=float),
+        row_by_row.drop(columns="URClass").to_numpy(dtype=float),
+        rtol=1e-12,
+        atol=1e-12,
+    )
+
+
+def test_rows_with_missing_years_have_no_prediction():
+    predictions = fn_calc(batched=True)[["FTTP2024", "FTTP2028"]].to_numpy()
+    assert np.isnan(predictions[[1, 2]]).all()
+    assert not np.isnan(predictions[[0, 3, 4, 5]]).any()
+
+
+@pytest.mark.filterwarnings("error::pandas.errors.SettingWithCopyWarning")
+def test_batched_fit_matches_row_by_row_for_one_class():
+    batched = fn_calc(batched=True, urclass="Rural")
+    row_by_row = fn_calc(batched=False, urclass="Rural")
+    assert len(batched) == 3
+    np.testing.assert_allclose(
+        batched.drop(columns="URClass").to_numpy(dtype=float),
+        row_by_row.drop(columns="URClass").to_numpy(dtype=float),
+        rtol=1e-12,
+        atol=1e-12,
+    )
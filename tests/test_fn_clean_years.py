@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+from files.backend import Backend
+
+
+def test_unparseable_cells_stay_in_their_cell():
+    backend = Backend.__new__(Backend)
+    backend.parse_failures = None
+    df = pd.DataFrame(
+        {"2019": ['1"2', "3,000", "-"], "2020": ['"4', "5%", "6\n7"], "Country": "UK"}
+    )
+    df = backend.fn_clean_years(df, ["2019", "2020"])
+    np.testing.assert_array_equal(
+        df[["2019", "2020"]].to_numpy(), [[np.nan, np.nan], [3000, 5], [np.nan, np.nan]]
+    )
+    assert list(backend.parse_failures["value"]) == ['1"2', '"4', "6\n7"]